@@ -2,14 +2,17 @@ import os
 import re
 import time
 import uuid
-import base64
+import shutil
+import threading
+import traceback
 import fitz  # PyMuPDF
 from tqdm import tqdm
-from PIL import Image
+import tempfile
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from datetime import datetime
-from flask import Flask, request, session, send_file, jsonify, redirect, url_for
+from flask import Flask, request, session, send_file, jsonify, redirect, url_for, has_request_context
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 from flask_cors import CORS
@@ -24,6 +27,17 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnablePassthrough
 
+import jobs
+import cache
+import render
+import vision
+import llm_cache
+import clients
+import speech
+import audio_probe
+from history import ScriptHistory
+from pipeline import Stage, run_pipeline
+
 load_dotenv()
 
 app = Flask(__name__)
@@ -59,50 +73,94 @@ def after_request(response):
         })
     return response
 
+# streaming pipeline tuning: concurrent TTS calls / ffmpeg encodes per job, and
+# how many slides may wait between two stages
+TTS_WORKERS = int(os.getenv("MAESTRO_TTS_WORKERS", "3"))
+# TTS attempts per slide (see generate_slide_audio); clients.call already retries throttling
+# and 5xx, this covers what it does not (dropped connections, short writes)
+TTS_SLIDE_ATTEMPTS = int(os.getenv("MAESTRO_TTS_SLIDE_ATTEMPTS", "3"))
+ENCODE_WORKERS = int(os.getenv("MAESTRO_ENCODE_WORKERS", "2"))
+PIPELINE_QUEUE_SIZE = int(os.getenv("MAESTRO_PIPELINE_QUEUE_SIZE", "2"))
+
+# "parallel" scripts slides concurrently against a text outline of the whole deck built in
+# one cheap pre-pass; "sequential" chains every slide through the conversation history
+SCRIPT_MODE = os.getenv("MAESTRO_SCRIPT_MODE", "parallel")
+SCRIPT_WORKERS = int(os.getenv("MAESTRO_SCRIPT_WORKERS", "6"))
+
+# every slide segment is encoded with the same settings so they can be concatenated without re-encoding
+SEGMENT_FPS = 25
+
 qa_chain = None
 content_filter = None
 scripts_global = None
+# identifies the lecture and prompt behind qa_chain, for the QA response cache
+qa_fingerprint = None
 
 def setup_directories():
     """Create necessary directories on startup, if they don't exist."""
-    for d in ["uploads", "output/images", "output/scripts", "output/audio", "static"]:
+    for d in [jobs.WORKSPACE_ROOT, "static"]:
         os.makedirs(d, exist_ok=True)
-
-with app.app_context():
-    setup_directories()
-
-def clean_directories(keep_video=None):
+    # pick up jobs checkpointed before a restart, then drop the ones past retention
+    jobs.load_jobs()
+    prune_old_jobs()
+    # start the render processes while the server is still single-threaded
+    render.start_pool()
+    # frames a crashed server left in shared memory
+    orphaned = render.remove_orphaned_frames()
+    if orphaned:
+        print(f"Removed {orphaned} orphaned frame buffer(s) from shared memory")
+
+def clean_directories(job_ids=()):
     """
-    cleanup policy: removes old files from directories when a new file is uploaded.
-    :param keep_video: path to the final MP4 we do NOT want to remove.
+    cleanup policy: removes the workspaces and videos of the given jobs, and the jobs
+    themselves, so their status no longer points at deleted files.
+    Jobs that are still running are skipped; their workers clean up when they finish.
     """
-    # remove all previous uploaded pdfs
-    uploads_dir = "uploads"
-    if os.path.exists(uploads_dir):
-        for f in os.listdir(uploads_dir):
-            if f.endswith(".pdf"):
-                os.remove(os.path.join(uploads_dir, f))
+    for job_id in job_ids:
+        job = jobs.get_job(job_id)
+        if job and not job.finished:
+            continue
+        try:
+            workspace = jobs.Workspace(job_id)
+        except ValueError:
+            continue
+        workspace.destroy()
+        shutil.rmtree(os.path.join("static", workspace.job_id), ignore_errors=True)
+        jobs.remove_job(workspace.job_id)
 
-    # remove all processing directories
-    for output_dir in ["output/images", "output/scripts", "output/audio"]:
-        if os.path.exists(output_dir):
-            for f in os.listdir(output_dir):
-                os.remove(os.path.join(output_dir, f))
+def prune_old_jobs():
+    """
+    Apply the job retention policy (see jobs.prune_jobs) and delete the videos of the
+    pruned jobs, plus video directories no known job owns any more.
+    """
+    pruned = jobs.prune_jobs()
+    clean_directories(pruned)
+    cutoff = time.time() - jobs.JOB_TTL_HOURS * 3600
+    for name in os.listdir("static"):
+        path = os.path.join("static", name)
+        try:
+            owned = jobs.get_job(str(uuid.UUID(name))) is not None
+        except ValueError:
+            # not a job's video directory
+            continue
+        if not owned and jobs.JOB_TTL_HOURS > 0 and os.path.getmtime(path) < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+            pruned.append(name)
+    if pruned:
+        print(f"Pruned {len(pruned)} expired job(s)")
+    return pruned
 
-    # clean static directory
-    static_dir = "static"
-    if os.path.exists(static_dir):
-        for f in os.listdir(static_dir):
-            if f.endswith(".mp4"):
-                file_path = os.path.join(static_dir, f)
+# render workers import this module as __mp_main__; only the server sets up
+if __name__ != "__mp_main__":
+    with app.app_context():
+        setup_directories()
 
-                if keep_video and os.path.abspath(file_path) != os.path.abspath(keep_video):
-                    os.remove(file_path)
+# job IDs kept in the session cookie for clear_session
+SESSION_MAX_JOBS = 20
 
 # helper functions
-def save_uploaded_file(uploaded_file, unique_id):
-    """Save uploaded PDF to 'uploads' with a unique ID prefix."""
-    uploads_dir = "uploads"
+def save_uploaded_file(uploaded_file, unique_id, uploads_dir="uploads"):
+    """Save uploaded PDF to uploads_dir with a unique ID prefix."""
     os.makedirs(uploads_dir, exist_ok=True)
     
     original_filename = secure_filename(uploaded_file.filename)
@@ -112,25 +170,32 @@ def save_uploaded_file(uploaded_file, unique_id):
     uploaded_file.save(file_path)
     return file_path
 
-def encode_image(image_path):
-    """
-    Helper function to convert an image to base64.
-    """
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
-
-def generate_slide_script(image_path, slide_number, total_slides, previous_content=None, api_key=None):
-    """
-    generates a teaching script
-    """
-    from openai import OpenAI
-    client = OpenAI(api_key=api_key)
-
-    base64_image = encode_image(image_path)
-    
-    system_message = {
-        "role": "system",
-        "content": """You are an expert computer science lecturer delivering clear, concise explanations.
+SCRIPT_MODEL = "gpt-4o"
+SCRIPT_MAX_TOKENS = 350
+SCRIPT_TEMPERATURE = 0.7
+# script text-only and title slides from the PDF text layer instead of sending the image
+TEXT_FAST_PATH = os.getenv("MAESTRO_TEXT_FAST_PATH", "1") == "1"
+# consecutive near-identical pages (build/animation steps): "delta" narrates only what a page
+# adds to the previous one, "merge" keeps just the last page of each group, "off" disables it
+DUPLICATE_MODE = os.getenv("MAESTRO_DUPLICATE_MODE", "delta")
+OUTLINE_MODEL = os.getenv("MAESTRO_OUTLINE_MODEL", "gpt-4o-mini")
+# text of a single slide sent to the outline pass or shown as a neighbor
+OUTLINE_MAX_CHARS = 600
+# stream script tokens and start TTS on each completed sentence instead of waiting for the
+# whole script; the slide's audio is then a WAV assembled from the PCM pieces. Off by default:
+# it costs roughly three TTS requests per slide instead of one, so under a requests/minute
+# limit (MAESTRO_TTS_RPM) a deck takes longer overall; it pays off only for time-to-first-audio
+# with a high TTS rate limit (raise MAESTRO_STREAM_MIN_CHARS to send fewer, longer pieces)
+STREAM_TTS = os.getenv("MAESTRO_STREAM_TTS", "0") == "1"
+TTS_MODEL = "tts-1"
+# the Q&A embeddings normally count tokens with tiktoken, which downloads its encoding on
+# first use; against a stand-in API (OPENAI_BASE_URL, e.g. src/Mock-Providers) the scripts
+# are embedded whole instead, which lets the app run fully offline (scripts are far below
+# the embedding model's context length anyway)
+EMBEDDINGS_COUNT_TOKENS = "api.openai.com" in os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+TTS_VOICE = "alloy"
+
+SCRIPT_SYSTEM_PROMPT = """You are an expert computer science lecturer delivering clear, concise explanations.
 Rules:
 1. ONLY explain visible content
 2. Use natural speech patterns
@@ -147,57 +212,151 @@ Speaking style:
 - Professional but approachable
 - Concise yet thorough
 """
-    }
-    
-    position_instructions = {
-        "first": "Just mention the name of the algorithm or topic we will explore. Duration: 2-5 seconds.",
-        "middle": ("Continue the technical explanation, connecting with previous concepts. "
-                   "Typically 40-90 seconds, but if the slide is mostly a short title or an outline, keep it 4-15 seconds."),
-        "last": "Conclude the visible content naturally."
-    }
 
-    if slide_number == 1:
-        position = "first"
-    elif slide_number == total_slides:
-        position = "last"
-    else:
-        position = "middle"
-    
-    user_message = {
-        "role": "user",
-        "content": [
-            {
-                "type": "text",
-                "text": f"""Generate a teaching script following these parameters:
+POSITION_INSTRUCTIONS = {
+    "first": "Just mention the name of the algorithm or topic we will explore. Duration: 2-5 seconds.",
+    "middle": ("Continue the technical explanation, connecting with previous concepts. "
+               "Typically 40-90 seconds, but if the slide is mostly a short title or an outline, keep it 4-15 seconds."),
+    "last": "Conclude the visible content naturally."
+}
+
+SCRIPT_USER_PROMPT = """Generate a teaching script following these parameters:
 1. Content scope: Only explain visible elements and avoid mentioning what we will come in coming slides
-2. Position context: {position_instructions[position]}
+2. Position context: {position_instructions}
 3. Technical accuracy: Maintain precise terminology
 4. Flow: Natural transitions between concepts
 5. Avoid repeating 'Building upon'"""
-            },
-            {
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/jpeg;base64,{base64_image}"
-                }
-            }
-        ]
+
+OUTLINE_PROMPT = """You will receive the extracted text of every slide of a lecture.
+Write an outline with exactly one line per slide, in the form "<slide number>. <summary>".
+Each summary is at most 15 words and names the concept the slide covers.
+Slides marked as figures have no text; infer their topic from the surrounding slides."""
+
+NO_TEXT_PLACEHOLDER = "(figure or image without text)"
+
+def slide_position(slide_number, total_slides):
+    if slide_number == 1:
+        return "first"
+    elif slide_number == total_slides:
+        return "last"
+    return "middle"
+
+def script_cache_key(pixel_hash, slide_number, total_slides, slide_text=None, kind=None,
+                     outline_lines=None, neighbor_context=None):
+    """
+    Cache key for a slide script: rendered pixels plus everything that shapes the prompt.
+    In parallel mode the prompt carries the whole deck outline, but the key only takes the
+    slide's own outline lines (see outline_lines): editing one slide then re-scripts that
+    slide and its neighbors instead of the whole deck, at the price of reusing scripts that
+    were written against an older version of the far-away outline lines.
+    """
+    return cache.hash_key(
+        "script", pixel_hash, slide_position(slide_number, total_slides),
+        SCRIPT_MODEL, SCRIPT_MAX_TOKENS, SCRIPT_TEMPERATURE,
+        SCRIPT_SYSTEM_PROMPT, SCRIPT_USER_PROMPT, POSITION_INSTRUCTIONS,
+        slide_text or "", kind or "", outline_lines or "", neighbor_context or "",
+        "" if slide_text else vision.payload_settings()
+    )
+
+def uses_text_fast_path(analysis):
+    """Text-only and title/outline slides are scripted from their text layer, without an image."""
+    return TEXT_FAST_PATH and analysis.get("kind") in ("text", "title") and bool(analysis.get("text"))
+
+def audio_cache_key(script_text):
+    return cache.hash_key("tts", script_text, TTS_MODEL, TTS_VOICE)
+
+def generate_slide_script(image_path, slide_number, total_slides, previous_content=None, api_key=None,
+                          slide_text=None, kind=None, deck_outline=None, neighbor_context=None, usage=None,
+                          use_cache=True, on_delta=None):
+    """
+    generates a teaching script.
+    With slide_text (from the PDF text layer) the slide is described to the model in text
+    and no image is sent; kind "title" asks for a short, title/outline-style script and
+    kind "delta" treats slide_text as the lines a build step adds to the previous slide.
+    deck_outline and neighbor_context (see deck_outline_text / neighbor_text) replace the
+    conversation history when slides are scripted independently of each other.
+    Images go through vision.prepare_image, at the detail level vision.choose_detail picks
+    for the slide's kind.
+    If a usage dict is passed, the call's prompt/completion token counts (and the image's
+    bytes and estimated tokens) are stored in it.
+    Responses come from the LLM response cache unless use_cache is false. With on_delta the
+    response is streamed and on_delta(text) receives the script as it is generated.
+    """
+    client = clients.openai_client(api_key)
+    
+    system_message = {
+        "role": "system",
+        "content": SCRIPT_SYSTEM_PROMPT
     }
+
+    position = slide_position(slide_number, total_slides)
+    prompt = SCRIPT_USER_PROMPT.format(position_instructions=POSITION_INSTRUCTIONS[position])
+    if neighbor_context:
+        prompt = f"{neighbor_context}\n\nYou are now scripting slide {slide_number} of {total_slides}.\n{prompt}"
+
+    if slide_text and kind == "delta":
+        user_message = {
+            "role": "user",
+            "content": (f"{prompt}\n\nThis slide is the previous slide with only these lines added:\n"
+                        f"{slide_text}\n\nBriefly explain just the new content (typically 5-25 seconds) "
+                        f"without repeating what was already said.")
+        }
+    elif slide_text:
+        if kind == "title":
+            prompt += "\n6. This slide is a title or outline: keep it to 4-15 seconds."
+        user_message = {
+            "role": "user",
+            "content": f"{prompt}\n\nThe visible content of the slide is:\n{slide_text}"
+        }
+    else:
+        payload = vision.prepare_image(image_path, vision.choose_detail(kind))
+        print(f"Slide {slide_number}: sending {payload['bytes']} bytes image "
+              f"({payload['width']}x{payload['height']}, detail {payload['detail']}, ~{payload['tokens']} tokens)")
+        if usage is not None:
+            usage["image_bytes"] = payload["bytes"]
+            usage["image_tokens"] = payload["tokens"]
+        user_message = {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": prompt
+                },
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": payload["url"],
+                        "detail": payload["detail"]
+                    }
+                }
+            ]
+        }
     
     messages = [system_message]
+    if deck_outline:
+        # same for every slide of the deck, so it stays part of the shared prompt prefix
+        messages.append({"role": "system", "content": deck_outline})
     if previous_content:
         messages.extend(previous_content)
     messages.append(user_message)
     
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
+        response = llm_cache.chat_completion(
+            client,
+            use_cache=use_cache,
+            on_delta=on_delta,
+            model=SCRIPT_MODEL,
             messages=messages,
-            max_tokens=350,
-            temperature=0.7
+            max_tokens=SCRIPT_MAX_TOKENS,
+            temperature=SCRIPT_TEMPERATURE
         )
-        script_text = response.choices[0].message.content
-        return script_text, messages
+        if response["cached"]:
+            print(f"Slide {slide_number}: response cache hit")
+        elif response["usage"]:
+            print(f"Slide {slide_number}: {response['usage']['prompt_tokens']} prompt tokens")
+            if usage is not None:
+                usage.update(response["usage"])
+        return response["content"], messages
     except Exception as e:
         print(f"Error generating script for slide {slide_number}: {str(e)}")
         return "", messages
@@ -205,21 +364,45 @@ Speaking style:
 def generate_audio(script_text, slide_number, output_dir, api_key=None):
     """
     Create an MP3 from script_text using your specialized TTS endpoint.
+    The request is rate limited and retried by clients.call. The file is written under a
+    temporary name and renamed once complete, so a partial MP3 is never left at audio_path.
     """
-    from openai import OpenAI
-    client = OpenAI(api_key=api_key)
+    client = clients.openai_client(api_key)
     
-    response = client.audio.speech.create(
-        model="tts-1",
-        voice="alloy",
+    response = clients.call("tts", api_key, lambda: client.audio.speech.create(
+        model=TTS_MODEL,
+        voice=TTS_VOICE,
         input=script_text
-    )
+    ))
     
     audio_path = os.path.join(output_dir, f"slide_{slide_number}.mp3")
-    response.stream_to_file(audio_path)
-    time.sleep(1)  # small delay to ensure file is written
+    tmp_path = f"{audio_path}.tmp"
+    try:
+        response.write_to_file(tmp_path)
+        size = os.path.getsize(tmp_path)
+        expected = response.response.headers.get("content-length")
+        if size == 0 or (expected and int(expected) != size):
+            raise IOError(f"audio for slide {slide_number} is incomplete ({size} of {expected or '?'} bytes)")
+        os.replace(tmp_path, audio_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    duration = audio_probe.parse_duration(response.content)
+    if duration is not None:
+        audio_probe.record_duration(audio_path, duration)
     return audio_path
 
+def synthesize_speech_pcm(text, api_key=None):
+    """Raw 24 kHz 16-bit mono PCM for text, for streamed TTS (see speech.SpeechStream)."""
+    client = clients.openai_client(api_key)
+    response = clients.call("tts", api_key, lambda: client.audio.speech.create(
+        model=TTS_MODEL,
+        voice=TTS_VOICE,
+        input=text,
+        response_format="pcm"
+    ))
+    return response.content
+
 def natural_sort_key(s):
     """
     For sorting 'page_1.png', 'page_2.png', etc.
@@ -228,93 +411,280 @@ def natural_sort_key(s):
     return [int(text) if text.isdigit() else text.lower()
             for text in re.split(r'(\d+)', s)]
 
-def convert_pdf_to_images(pdf_path):
+def iter_pdf_pages(pdf_path, workspace, completed=None, write_png=None):
     """
-    Convert PDF to images in output/images/.
+    Render PDF pages on a process pool, yielding a slide dict per page, in page order,
+    as soon as its video-resolution pixels and vision image exist. In raw frame mode
+    (see render.FRAME_INPUT) the pixels arrive as slide["frame"], which the consumer
+    must take() or release(), and no PNG is written unless write_png asks for one.
+    completed maps page numbers to slide records of an earlier run; pages whose outputs are
+    still on disk are yielded from there without rendering them again.
     """
-    images_dir = "output/images"
-    os.makedirs(images_dir, exist_ok=True)
+    os.makedirs(workspace.images_dir, exist_ok=True)
+    os.makedirs(workspace.vision_dir, exist_ok=True)
+    completed = completed or {}
 
     pdf_document = fitz.open(pdf_path)
-    for page_number in tqdm(range(pdf_document.page_count), desc="Converting PDF pages", unit="page"):
-        page = pdf_document[page_number]
-        zoom = 300 / 72
-        matrix = fitz.Matrix(zoom, zoom)
-        pixmap = page.get_pixmap(matrix=matrix)
-        img_data = Image.frombytes("RGB", [pixmap.width, pixmap.height], pixmap.samples)
-        output_path = os.path.join(images_dir, f'page_{page_number + 1}.png')
-        img_data.save(output_path, 'PNG')
-    
-    pdf_document.close()
-    return images_dir
+    total_slides = pdf_document.page_count
+
+    def reusable(page_number):
+        # the pixels are only needed again if the slide's segment is missing
+        record = completed.get(page_number + 1, {})
+        return (bool(record.get("pixel_hash"))
+                and os.path.exists(record.get("vision_path") or "")
+                and (os.path.exists(record.get("image_path") or "")
+                     or os.path.exists(record.get("segment_path") or "")))
+
+    rendered = render.render_pages(
+        pdf_path, workspace.images_dir, workspace.vision_dir,
+        [page_number for page_number in range(total_slides) if not reusable(page_number)],
+        write_png=write_png
+    )
+    try:
+        for page_number in range(total_slides):
+            if reusable(page_number):
+                page = dict(completed[page_number + 1], frame=None)
+                # checkpoints keep only the dhash: the thumbnail comes back from the vision
+                # image and the analysis from the text layer, both far cheaper than a render
+                page["fingerprint"] = render.file_fingerprint(page["vision_path"])
+                page["analysis"] = render.analyze_page(pdf_document[page_number])
+            else:
+                _, page = next(rendered)
+            yield {
+                "number": page_number + 1,
+                "total": total_slides,
+                "image_path": page.get("image_path"),
+                "vision_path": page["vision_path"],
+                "frame": page["frame"],
+                "pixel_hash": page["pixel_hash"],
+                "fingerprint": page["fingerprint"],
+                "analysis": page["analysis"]
+            }
+    finally:
+        rendered.close()
+        pdf_document.close()
 
-def generate_scripts_for_images(images_dir, api_key):
+def convert_pdf_to_images(pdf_path, workspace):
     """
-    Generate a text script for each image (slide), building a conversation context across them.
+    Convert PDF to video-resolution PNGs (and vision images) in the job workspace.
+    """
+    with fitz.open(pdf_path) as pdf_document:
+        total_pages = pdf_document.page_count
+    for _ in tqdm(iter_pdf_pages(pdf_path, workspace, write_png=True), total=total_pages,
+                  desc="Converting PDF pages", unit="page"):
+        pass
+    return workspace.images_dir
+
+def extract_page_analyses(pdf_path):
+    """Text-layer analysis (see render.analyze_page) of every page, without rasterizing."""
+    with fitz.open(pdf_path) as pdf_document:
+        return [render.analyze_page(page) for page in pdf_document]
+
+def build_deck_outline(analyses, api_key=None):
+    """
+    Cheap pre-pass for parallel scripting: a single text-only call that summarizes every
+    slide in one line, working from the PDF text layer. Returns {slide number: summary}.
+    If the call fails, each slide falls back to the first line of its text.
+    """
+    outline = {}
+    listing = []
+    for number, analysis in enumerate(analyses, start=1):
+        text = (analysis.get("text") or "").strip()
+        outline[number] = text.splitlines()[0][:120] if text else NO_TEXT_PLACEHOLDER
+        listing.append(f"Slide {number}: {text[:OUTLINE_MAX_CHARS] if text else NO_TEXT_PLACEHOLDER}")
+    listing = "\n\n".join(listing)
+
+    client = clients.openai_client(api_key)
+    try:
+        outline_text = llm_cache.chat_completion(
+            client,
+            model=OUTLINE_MODEL,
+            messages=[
+                {"role": "system", "content": OUTLINE_PROMPT},
+                {"role": "user", "content": listing}
+            ],
+            max_tokens=min(16000, 40 * len(analyses) + 100),
+            temperature=0
+        )["content"]
+    except Exception as e:
+        print(f"Error building deck outline: {str(e)}")
+        return outline
+
+    for match in re.finditer(r"^\s*(?:Slide\s*)?(\d+)\s*[.:)-]\s*(.+?)\s*$", outline_text, re.MULTILINE):
+        number = int(match.group(1))
+        if number in outline:
+            outline[number] = match.group(2)
+    return outline
+
+def deck_outline_text(outline):
+    return "Outline of the whole lecture, one line per slide:\n" + "\n".join(
+        f"{number}. {summary}" for number, summary in sorted(outline.items())
+    )
+
+def outline_lines(outline, slide_number):
+    """The outline lines of slide_number and its neighbors, the part of the outline a slide's cache key depends on."""
+    return "\n".join(outline.get(number, "") for number in (slide_number - 1, slide_number, slide_number + 1))
+
+def neighbor_text(analyses, outline, slide_number):
+    """Text of the slides right before and after slide_number, for continuity."""
+    parts = []
+    for label, number in (("Previous slide", slide_number - 1), ("Next slide", slide_number + 1)):
+        if 1 <= number <= len(analyses):
+            text = (analyses[number - 1].get("text") or "").strip()
+            parts.append(f"{label} ({number}): {text[:OUTLINE_MAX_CHARS] if text else outline.get(number, '')}")
+    return "\n".join(parts)
+
+def iter_slide_scripts(slides, api_key, scripts_dir):
+    """
+    Lazily script an iterable of slide dicts (e.g. from iter_pdf_pages), yielding each
+    slide with its "script" as soon as it has been written to scripts_dir. Together with
+    a lazy page iterator only a fixed window of slides is ever resident in memory.
     """
-    scripts_dir = "output/scripts"
     os.makedirs(scripts_dir, exist_ok=True)
+    history = ScriptHistory()
+
+    for slide in slides:
+        analysis = slide.get("analysis") or {}
+        script_text, _ = generate_slide_script(
+            slide.get("vision_path") or slide["image_path"],
+            slide_number=slide["number"],
+            total_slides=slide["total"],
+            previous_content=history.messages(),
+            api_key=api_key,
+            slide_text=analysis["text"] if uses_text_fast_path(analysis) else None,
+            kind=analysis.get("kind")
+        )
+        history.add(slide["number"], script_text)
+
+        # save script to file
+        script_path = os.path.join(scripts_dir, f"slide_{slide['number']}_script.txt")
+        with open(script_path, "w", encoding="utf-8") as f:
+            f.write(script_text)
+
+        slide["script"] = script_text
+        yield slide
+
+def generate_scripts_for_images(workspace, api_key, progress_callback=None, pdf_path=None):
+    """
+    Generate a text script for each image (slide), building a conversation context across them.
+    With pdf_path and SCRIPT_MODE "parallel", the deck outline is built first and the slides
+    are scripted concurrently against it instead.
+    progress_callback(done, total) is called after each slide.
+    """
+    images_dir = workspace.images_dir
 
     # sort images in natural order
     image_files = sorted(
         [os.path.join(images_dir, f) for f in os.listdir(images_dir) if f.endswith(".png")],
         key=natural_sort_key
     )
-
     total_slides = len(image_files)
-    conversation_history = []
-    scripts_list = []
 
-    for i, image_file in enumerate(image_files, start=1):
-        script_text, updated_history = generate_slide_script(
-            image_file,
-            slide_number=i,
-            total_slides=total_slides,
-            previous_content=conversation_history,
-            api_key=api_key
-        )
-        # update conversation
-        conversation_history = updated_history
-        conversation_history.append({"role": "assistant", "content": script_text})
-        
-        # save script to file
-        script_path = os.path.join(scripts_dir, f"slide_{i}_script.txt")
-        with open(script_path, "w", encoding="utf-8") as f:
-            f.write(script_text)
-        
-        scripts_list.append(script_text)
+    def slides():
+        for i, image_file in enumerate(image_files, start=1):
+            # the model gets the downscaled image when convert_pdf_to_images produced one
+            vision_file = os.path.join(workspace.vision_dir, os.path.basename(image_file)[:-len(".png")] + vision.FILE_SUFFIX)
+            yield {
+                "number": i,
+                "total": total_slides,
+                "image_path": image_file,
+                "vision_path": vision_file if os.path.exists(vision_file) else None
+            }
+
+    if SCRIPT_MODE == "parallel" and pdf_path:
+        analyses = extract_page_analyses(pdf_path)
+        outline = build_deck_outline(analyses, api_key)
+        deck_outline = deck_outline_text(outline)
+        os.makedirs(workspace.scripts_dir, exist_ok=True)
+
+        def script(slide):
+            analysis = analyses[slide["number"] - 1] if slide["number"] <= len(analyses) else {}
+            script_text, _ = generate_slide_script(
+                slide["vision_path"] or slide["image_path"],
+                slide_number=slide["number"],
+                total_slides=slide["total"],
+                api_key=api_key,
+                slide_text=analysis["text"] if uses_text_fast_path(analysis) else None,
+                kind=analysis.get("kind"),
+                deck_outline=deck_outline,
+                neighbor_context=neighbor_text(analyses, outline, slide["number"])
+            )
+            script_path = os.path.join(workspace.scripts_dir, f"slide_{slide['number']}_script.txt")
+            with open(script_path, "w", encoding="utf-8") as f:
+                f.write(script_text)
+            return script_text
+
+        with ThreadPoolExecutor(max_workers=SCRIPT_WORKERS) as executor:
+            futures = [executor.submit(script, slide) for slide in slides()]
+            for done, _ in enumerate(as_completed(futures), start=1):
+                if progress_callback:
+                    progress_callback(done, total_slides)
+        return [future.result() for future in futures]
+
+    scripts_list = []
+    for slide in iter_slide_scripts(slides(), api_key, workspace.scripts_dir):
+        scripts_list.append(slide["script"])
+        if progress_callback:
+            progress_callback(slide["number"], total_slides)
 
     return scripts_list
 
-def generate_audio_files(scripts_list, api_key):
+def generate_slide_audio(script_text, slide_number, output_dir, api_key=None, attempts=TTS_SLIDE_ATTEMPTS):
+    """
+    generate_audio with up to `attempts` tries. Client errors (bad key, rejected input)
+    fail at once since repeating the request cannot fix them.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return generate_audio(script_text, slide_number, output_dir, api_key=api_key)
+        except Exception as e:
+            status = getattr(e, "status_code", None)
+            if attempt >= attempts or (status and 400 <= status < 500):
+                raise
+            print(f"Slide {slide_number}: audio attempt {attempt}/{attempts} failed ({e}), retrying")
+
+def generate_audio_files(scripts_list, workspace, api_key, progress_callback=None):
     """
-    Generate MP3 audio for each script, saved in output/audio/.
+    Batch path, kept for scripts that drive the steps one by one; uploads go through
+    run_slide_pipeline, whose TTS stage runs generate_slide_audio on TTS_WORKERS threads.
+    Generate MP3 audio for each script, saved in the job workspace. Up to TTS_WORKERS
+    slides are synthesized at once (within the key's limits in clients.call).
+    progress_callback(done, total) is called as slides finish.
+    Returns the audio paths in slide order, None for slides with an empty script.
+    Raises the first slide's error once its retries are spent.
     """
-    audio_dir = "output/audio"
+    audio_dir = workspace.audio_dir
     os.makedirs(audio_dir, exist_ok=True)
+    total = len(scripts_list)
 
-    for i, script_text in enumerate(scripts_list, start=1):
-        if not script_text.strip():
-            print(f"Warning: Script for slide {i} is empty. Skipping audio generation.")
-            continue
-        audio_path = generate_audio(script_text, i, audio_dir, api_key=api_key)
-        if not (os.path.exists(audio_path) and os.path.getsize(audio_path) > 0):
-            print(f"Warning: Audio file {audio_path} not created properly")
+    futures = {}
+    with ThreadPoolExecutor(max_workers=TTS_WORKERS) as executor:
+        for i, script_text in enumerate(scripts_list, start=1):
+            if not script_text.strip():
+                print(f"Warning: Script for slide {i} is empty. Skipping audio generation.")
+                continue
+            futures[i] = executor.submit(generate_slide_audio, script_text, i, audio_dir, api_key)
 
-    return audio_dir
+        done = total - len(futures)
+        try:
+            for future in as_completed(futures.values()):
+                future.result()
+                done += 1
+                if progress_callback:
+                    progress_callback(done, total)
+        except Exception:
+            for future in futures.values():
+                future.cancel()
+            raise
+
+    return [futures[i].result() if i in futures else None for i in range(1, total + 1)]
 
 def get_audio_duration(audio_path):
     """
-    Get audio duration using ffprobe.
+    Get audio duration: recorded when the file was written, else read from its frame
+    headers in-process; ffprobe only for files the parser does not understand.
     """
-    
-    result = subprocess.run(
-        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
-         '-of', 'default=noprint_wrappers=1:nokey=1', audio_path],
-        capture_output=True,
-        text=True
-    )
-    return float(result.stdout.strip()) if result.stdout.strip() else 0.0
+    return audio_probe.get_duration(audio_path)
 
 def get_sorted_pairs(images_dir, audio_dir):
     """
@@ -331,7 +701,7 @@ def get_sorted_pairs(images_dir, audio_dir):
             if int(re.search(r'page_(\d+)', img).group(1)) == 
                int(re.search(r'slide_(\d+)', aud).group(1))]
 
-def create_video_ffmpeg(images_dir, audio_dir, output_path="slideshow.mp4"):
+def create_video_ffmpeg(workspace, output_path="slideshow.mp4"):
     """
     Create final video with proper synchronization between slides and audio.
     Each slide is shown exactly for the duration of its corresponding audio track.
@@ -339,16 +709,17 @@ def create_video_ffmpeg(images_dir, audio_dir, output_path="slideshow.mp4"):
 
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
     
-    pairs = get_sorted_pairs(images_dir, audio_dir)
+    pairs = get_sorted_pairs(workspace.images_dir, workspace.audio_dir)
     if not pairs:
         raise ValueError("No valid image-audio pairs found")
 
     filter_complex = []
     inputs = []
+    durations = audio_probe.probe_directory(workspace.audio_dir)
     
     for i, (img, aud) in enumerate(pairs):
         inputs.extend(['-loop', '1', '-i', img, '-i', aud])
-        duration = get_audio_duration(aud)
+        duration = durations[os.path.basename(aud)]
         filter_complex.extend([
             f'[{2*i}:v]trim=duration={duration},setpts=PTS-STARTPTS[v{i}];',
             f'[{2*i+1}:a]acopy[a{i}];'
@@ -388,6 +759,363 @@ def create_video_ffmpeg(images_dir, audio_dir, output_path="slideshow.mp4"):
         
     print(f"Video created successfully at: {output_path}")
 
+def encode_slide_segment(image_path, audio_path, segment_path, duration, frame=None):
+    """
+    Encode one slide (still image + narration) into a standalone MP4 segment.
+    With a render.Frame the pixels are piped to ffmpeg as rawvideo, skipping PNG
+    encode/decode; otherwise image_path is read.
+    All segments share codec settings so concat_segments can join them without re-encoding.
+    """
+    # pages with another aspect ratio are letterboxed so every segment has the same frame size
+    video_filter = (f'scale={render.VIDEO_WIDTH}:{render.VIDEO_HEIGHT}:force_original_aspect_ratio=decrease,'
+                    f'pad={render.VIDEO_WIDTH}:{render.VIDEO_HEIGHT}:(ow-iw)/2:(oh-ih)/2:color=white,setsar=1')
+    if frame:
+        # a single raw frame, repeated by the loop filter for the whole duration
+        video_input = ['-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{frame.width}x{frame.height}',
+                       '-framerate', str(SEGMENT_FPS), '-i', 'pipe:0']
+        video_filter = 'loop=loop=-1:size=1:start=0,' + video_filter
+    else:
+        video_input = ['-loop', '1', '-framerate', str(SEGMENT_FPS), '-i', image_path]
+
+    cmd = [
+        'ffmpeg', '-y',
+        *video_input,
+        '-i', audio_path,
+        '-t', f'{duration:.3f}',
+        '-vf', video_filter,
+        '-c:v', 'libx264',
+        '-preset', 'veryfast',
+        '-tune', 'stillimage',
+        '-r', str(SEGMENT_FPS),
+        '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac',
+        '-b:a', '192k',
+        '-ar', '44100',
+        '-ac', '2',
+        segment_path
+    ]
+    # stderr goes to a temp file so a chatty ffmpeg can never block the stdin write
+    with tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE if frame else subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=errors
+        )
+        if frame:
+            try:
+                process.stdin.write(frame.pixels)
+            except BrokenPipeError:
+                pass  # ffmpeg exited early; its stderr says why
+            finally:
+                process.stdin.close()
+        returncode = process.wait()
+        if returncode != 0:
+            errors.seek(0)
+            stderr = errors.read().decode("utf-8", errors="replace")
+            raise RuntimeError(f"Failed to encode segment {segment_path}: {stderr}")
+    return segment_path
+
+def concat_segments(segment_paths, output_path):
+    """
+    Join pre-encoded slide segments into the final video with the concat demuxer (stream copy).
+    """
+    if not segment_paths:
+        raise ValueError("No slide segments to concatenate")
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    list_path = os.path.join(os.path.dirname(segment_paths[0]), "segments.txt")
+    with open(list_path, "w", encoding="utf-8") as f:
+        for path in segment_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+    cmd = [
+        'ffmpeg', '-y',
+        '-f', 'concat', '-safe', '0', '-i', list_path,
+        '-c', 'copy',
+        '-movflags', '+faststart',
+        output_path
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"FFmpeg error: {result.stderr}")
+        raise RuntimeError(f"Failed to create video: {result.stderr}")
+
+    if not os.path.exists(output_path):
+        raise RuntimeError(f"Video file was not created at {output_path}")
+
+    print(f"Video created successfully at: {output_path}")
+    return output_path
+
+def _completed(record, key):
+    """True if a checkpointed slide record has an output file for key that still exists."""
+    path = record.get(key)
+    return bool(path) and os.path.exists(path)
+
+def run_slide_pipeline(pdf_path, workspace, api_key, output_path, job=None, progress_callback=None):
+    """
+    Streaming version of convert -> scripts -> audio -> video.
+
+    Each slide moves through rasterize -> script -> TTS -> segment encode on its own,
+    connected by bounded queues, so slide 1 is being narrated and encoded while later
+    pages are still being rendered. Wall time approaches the slowest stage instead of
+    the sum of all stages. Scripts, MP3s and segments are looked up in the shared
+    artifact cache first, so unchanged slides of a re-uploaded deck cost nothing.
+
+    With a job, every finished stage is checkpointed in its manifest and outputs from an
+    earlier run are reused. A slide whose script, TTS or encode fails is recorded as failed
+    and left out of the video instead of failing the whole deck; retry it later.
+    In SCRIPT_MODE "parallel" a text-only outline of the deck is built before the first
+    page is rendered, and slides are scripted concurrently against it and their neighbors.
+    Returns the scripts in slide order.
+    progress_callback(done, total) is called as slides finish encoding.
+    """
+    scripts = {}
+    history = ScriptHistory()
+    parallel = SCRIPT_MODE == "parallel"
+    analyses = outline = deck_outline = None
+    if parallel:
+        started = time.time()
+        analyses = extract_page_analyses(pdf_path)
+        outline = build_deck_outline(analyses, api_key)
+        deck_outline = deck_outline_text(outline)
+        print(f"Deck outline for {len(analyses)} slides ready in {time.time() - started:.1f}s")
+
+    artifact_cache = cache.artifact_cache
+
+    def record(slide, **outputs):
+        if job:
+            job.record_slide(slide["number"], **outputs)
+
+    def previous(slide):
+        return job.slide_record(slide["number"]) if job else {}
+
+    def release_frame(slide):
+        # frames are plain memory by now (see pages); drop them once the segment no longer needs them
+        slide.pop("frame", None)
+
+    def fail(slide, stage, error):
+        print(f"Error in {stage} for slide {slide['number']}: {error}")
+        record(slide, failed=f"{stage}: {error}")
+        release_frame(slide)
+        return None
+
+    def pages():
+        for slide in iter_pdf_pages(pdf_path, workspace, completed):
+            if slide["frame"]:
+                # copy the pixels out of shared memory at once: /dev/shm then only holds the
+                # pages the render workers are ahead by, not every slide waiting on scripts and TTS
+                slide["frame"] = slide["frame"].take()
+            yield slide
+
+    def skip_duplicate(slide, merged_into):
+        record(slide, merged_into=merged_into)
+        release_frame(slide)
+        if job:
+            job.increment("duplicate_slides_skipped")
+
+    def deduplicated(slides):
+        """Apply DUPLICATE_MODE to runs of near-identical consecutive pages."""
+        previous = None
+        held = None  # merge mode: page waiting to see whether the next one supersedes it
+        for slide in slides:
+            delta = None
+            if previous is not None and DUPLICATE_MODE in ("delta", "merge"):
+                delta = render.page_delta(previous, slide)
+            previous = slide
+
+            if DUPLICATE_MODE == "merge":
+                if held is not None:
+                    if delta is not None:
+                        # the later build step shows everything the earlier one did
+                        skip_duplicate(held, slide["number"])
+                    else:
+                        yield held
+                held = slide
+                continue
+
+            if delta is not None:
+                if not delta:
+                    # looks the same as the page before: nothing new to narrate
+                    skip_duplicate(slide, slide["number"] - 1)
+                    continue
+                slide["delta"] = delta
+            yield slide
+        if held is not None:
+            yield held
+
+    def script_stage(slide):
+        # sequential mode has a single worker: slides arrive in page order, so the
+        # history stays linear; parallel mode never touches it
+        record(slide, image_path=slide["image_path"], vision_path=slide["vision_path"],
+               pixel_hash=slide["pixel_hash"], dhash=slide["fingerprint"]["dhash"])
+        script_path = os.path.join(workspace.scripts_dir, f"slide_{slide['number']}_script.txt")
+
+        done = previous(slide)
+        if _completed(done, "script_path"):
+            with open(script_path, "r", encoding="utf-8") as f:
+                script_text = f.read()
+        else:
+            # slides picked for regeneration on retry bypass both script caches
+            regenerate = bool(done.get("regenerate"))
+            analysis = slide["analysis"]
+            kind = analysis["kind"]
+            slide_text = analysis["text"] if uses_text_fast_path(analysis) else None
+            if slide.get("delta"):
+                # build step: only narrate the lines this page adds
+                kind, slide_text = "delta", "\n".join(slide["delta"])
+            neighbor_context = neighbor_text(analyses, outline, slide["number"]) if parallel else None
+            key = script_cache_key(slide["pixel_hash"], slide["number"], slide["total"], slide_text, kind,
+                                   outline_lines(outline, slide["number"]) if parallel else None,
+                                   neighbor_context)
+            script_text = None if regenerate else artifact_cache.get_text("scripts", key)
+            if script_text is None:
+                usage = {}
+                speech_stream = None
+                if STREAM_TTS:
+                    # TTS starts on the first sentences while the rest is still being generated
+                    speech_stream = speech.SpeechStream(lambda text: synthesize_speech_pcm(text, api_key))
+                script_text, _ = generate_slide_script(
+                    slide["vision_path"],
+                    slide_number=slide["number"],
+                    total_slides=slide["total"],
+                    previous_content=None if parallel else history.messages(),
+                    api_key=api_key,
+                    slide_text=slide_text,
+                    kind=kind,
+                    deck_outline=deck_outline,
+                    neighbor_context=neighbor_context,
+                    usage=usage,
+                    use_cache=not regenerate,
+                    on_delta=speech_stream.feed if speech_stream else None
+                )
+                if speech_stream:
+                    if script_text.strip():
+                        slide["speech"] = speech_stream
+                    else:
+                        speech_stream.cancel()
+                per_slide = {name: usage[name] for name in ("prompt_tokens", "image_bytes", "image_tokens")
+                             if name in usage}
+                if per_slide:
+                    record(slide, **per_slide)
+                if job:
+                    for name, tokens in usage.items():
+                        job.increment(name, tokens)
+                    job.increment("vision_calls_avoided" if slide_text else "vision_calls")
+                    if kind == "delta":
+                        job.increment("delta_scripts")
+                # failed calls return "" and must not poison the cache
+                if script_text.strip():
+                    artifact_cache.put_text("scripts", key, script_text)
+            with open(script_path, "w", encoding="utf-8") as f:
+                f.write(script_text)
+            if not script_text.strip():
+                return fail(slide, "script", "empty script")
+            record(slide, script_path=script_path)
+            if regenerate:
+                record(slide, regenerate=None)
+        if not parallel:
+            history.add(slide["number"], script_text)
+
+        scripts[slide["number"]] = script_text
+        slide["script"] = script_text
+        return slide
+
+    def audio_stage(slide):
+        done = previous(slide)
+        if _completed(done, "audio_path") and "duration" in done:
+            slide["audio_path"] = done["audio_path"]
+            slide["duration"] = done["duration"]
+            return slide
+
+        key = audio_cache_key(slide["script"])
+        speech_stream = slide.pop("speech", None)
+        if speech_stream:
+            audio_path = os.path.join(workspace.audio_dir, f"slide_{slide['number']}.wav")
+            try:
+                slide["duration"] = speech_stream.finish(audio_path)
+            except Exception as e:
+                return fail(slide, "tts", e)
+            audio_probe.record_duration(audio_path, slide["duration"])
+            artifact_cache.put_file("audio", key, audio_path, ".wav")
+            if job:
+                job.increment("streamed_tts_pieces", speech_stream.pieces)
+            slide["audio_path"] = audio_path
+            record(slide, audio_path=audio_path, duration=slide["duration"])
+            return slide
+
+        # streamed runs cache WAVs, the others MP3s: probe which one exists so the lookup
+        # is counted once per slide
+        suffix = ".wav" if artifact_cache.contains("audio", key, ".wav") else ".mp3"
+        audio_path = os.path.join(workspace.audio_dir, f"slide_{slide['number']}{suffix}")
+        if not artifact_cache.fetch("audio", key, audio_path, suffix):
+            try:
+                audio_path = generate_slide_audio(slide["script"], slide["number"], workspace.audio_dir,
+                                                  api_key=api_key)
+            except Exception as e:
+                return fail(slide, "tts", e)
+            if not (os.path.exists(audio_path) and os.path.getsize(audio_path) > 0):
+                return fail(slide, "tts", f"audio file {audio_path} not created properly")
+            artifact_cache.put_file("audio", key, audio_path, ".mp3")
+        slide["audio_path"] = audio_path
+        slide["duration"] = get_audio_duration(audio_path)
+        record(slide, audio_path=audio_path, duration=slide["duration"])
+        return slide
+
+    def encode_stage(slide):
+        done = previous(slide)
+        if _completed(done, "segment_path"):
+            slide["segment_path"] = done["segment_path"]
+            release_frame(slide)
+            record(slide, failed=None)
+            return slide
+
+        segment_path = os.path.join(workspace.segments_dir, f"slide_{slide['number']}.mp4")
+        key = cache.hash_key(
+            "segment", slide["pixel_hash"], cache.hash_file(slide["audio_path"]),
+            SEGMENT_FPS, render.VIDEO_WIDTH, render.VIDEO_HEIGHT, f"{slide['duration']:.3f}"
+        )
+        if not artifact_cache.fetch("segments", key, segment_path, ".mp4"):
+            try:
+                encode_slide_segment(slide["image_path"], slide["audio_path"], segment_path,
+                                     slide["duration"], frame=slide.get("frame"))
+            except Exception as e:
+                return fail(slide, "encode", e)
+            artifact_cache.put_file("segments", key, segment_path, ".mp4")
+        release_frame(slide)
+        slide["segment_path"] = segment_path
+        record(slide, segment_path=segment_path, failed=None)
+        return slide
+
+    finished = 0
+    def on_slide(slide):
+        nonlocal finished
+        finished += 1
+        if progress_callback:
+            progress_callback(finished, slide["total"])
+
+    completed = {}
+    if job:
+        completed = {int(number): dict(rec) for number, rec in job.slides.items()}
+
+    os.makedirs(workspace.segments_dir, exist_ok=True)
+    slides = run_pipeline(
+        deduplicated(pages()),
+        [
+            Stage("script", script_stage, workers=SCRIPT_WORKERS if parallel else 1,
+                  maxsize=PIPELINE_QUEUE_SIZE),
+            Stage("tts", audio_stage, workers=TTS_WORKERS, maxsize=PIPELINE_QUEUE_SIZE),
+            Stage("encode", encode_stage, workers=ENCODE_WORKERS, maxsize=PIPELINE_QUEUE_SIZE),
+        ],
+        on_item=on_slide
+    )
+
+    slides.sort(key=lambda slide: slide["number"])
+    concat_segments([slide["segment_path"] for slide in slides], output_path)
+
+    return [scripts[number] for number in sorted(scripts)]
+
 # flask endpoints
 
 @app.route("/setup_api", methods=["POST", "OPTIONS"])
@@ -417,9 +1145,50 @@ def check_session():
         "server_time": datetime.now().isoformat()
     })
 
+def process_upload(job, pdf_path, api_key, output_path, video_url, qa_threshold=0.04, safety_instructions=None):
+    """
+    Worker-side pipeline for one upload: streaming slide pipeline -> video -> QA.
+    Runs on the job pool, so it must not touch the request session.
+    Safe to call again for the same job: checkpointed slides are not redone.
+    """
+    def stage_progress(stage, start, end):
+        def callback(done, total):
+            job.update(stage=stage, progress=start + (end - start) * done / max(total, 1),
+                       details=f"{done}/{total} slides")
+        return callback
+
+    workspace = job.workspace.create()
+    job.update(stage="Processing slides", progress=2)
+    scripts = run_slide_pipeline(
+        pdf_path, workspace, api_key, output_path, job=job,
+        progress_callback=stage_progress("Processing slides", 2, 90)
+    )
+
+    if not os.path.exists(output_path):
+        raise RuntimeError(f"Video was not created at {output_path}")
+
+    failed_slides = job.failed_slide_numbers()
+    job.update(failed_slides=failed_slides)
+    if not failed_slides:
+        # the upload, scripts, audio and segments stay until the job is cleared or expires
+        # (see prune_old_jobs), so selected slides can still be regenerated; only the
+        # full-size page PNGs go, a regenerated slide is simply rendered again
+        workspace.cleanup([workspace.images_dir])
+
+    # setup QA system with the generated scripts; the video is done, so a Q&A failure
+    # only costs the chat, not the job
+    job.update(stage="Preparing Q&A", progress=95)
+    try:
+        setup_qa_for_chat(scripts, api_key, safety_instructions, threshold=qa_threshold)
+    except Exception as e:
+        traceback.print_exc()
+        job.update(details=f"Video ready; Q&A is unavailable: {e}")
+
+    return video_url
+
 @app.route('/upload_file', methods=['POST'])
 def upload_file():
-    """Handle PDF upload and video generation."""
+    """Accept a PDF upload and queue video generation; returns a job ID immediately."""
     # Get API key from multiple possible sources
     api_key = session.get('api_key')
     
@@ -441,51 +1210,107 @@ def upload_file():
     if not file.filename.endswith('.pdf'):
         return jsonify({"error": "Only PDF files are allowed"}), 400
 
+    prune_old_jobs()
     try:
-        # unique ID for this upload
-        unique_id = str(uuid.uuid4())
-        # video_filename = f"{unique_id}_slideshow.mp4"
-        filename = file.filename.split('.')[0]
-        video_filename = f"{filename}.mp4"
-        output_path = os.path.join(os.path.abspath("static"), video_filename)
-        
-        clean_directories(keep_video=output_path)
-        
-        pdf_path = save_uploaded_file(file, unique_id)
-        
-        try:
-            # PDF to images
-            images = convert_pdf_to_images(pdf_path)
-
-            # create scripts for each image
-            scripts = generate_scripts_for_images("output/images", session.get('api_key'))
-            generate_audio_files(scripts, session.get('api_key'))
-
-            # produce final video
-            create_video_ffmpeg("output/images", "output/audio", output_path)
-            
-            if not os.path.exists(output_path):
-                raise RuntimeError(f"Video was not created at {output_path}")
-            
-            # setup QA system with the generated scripts
-            setup_qa_for_chat(scripts, session.get('api_key'))
-            
+        job = jobs.create_job()
+    except jobs.JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503
+
+    try:
+        # each job writes its video to its own static subdirectory
+        filename = secure_filename(file.filename.rsplit('.', 1)[0]) or "slideshow"
+        video_filename = f"{job.id}/{filename}.mp4"
+        output_path = os.path.join(os.path.abspath("static"), job.id, f"{filename}.mp4")
+        pdf_path = save_uploaded_file(file, job.id, job.workspace.create().upload_dir)
+
+        job.params = {
+            'pdf_path': pdf_path,
+            'output_path': output_path,
             # video URL used by the frontend
-            video_url = f"/api/static/{video_filename}"
-            
-            return jsonify({
-                'success': True,
-                'video_path': video_url
-            })
-            
-        except Exception as e:
-            print(f"Error during processing: {str(e)}")
-            return jsonify({'error': str(e)}), 500
-            
+            'video_url': f"/api/static/{video_filename}",
+            'qa_threshold': session.get('qa_threshold', 0.04),
+            'safety_instructions': session.get('safety_instructions')
+        }
+        job.save()
+        jobs.submit_job(job, process_upload, job, api_key=api_key, **job.params)
     except Exception as e:
         print(f"Error during upload: {str(e)}")
+        job.update(status="failed", stage="Failed", error=str(e))
+        job.workspace.destroy()
         return jsonify({'error': str(e)}), 500
 
+    session['job_id'] = job.id
+    # the session is a cookie (~4KB at most): remember only the latest jobs; older ones are
+    # still removed by the retention policy (see prune_old_jobs)
+    session['job_ids'] = (session.get('job_ids', []) + [job.id])[-SESSION_MAX_JOBS:]
+    session.modified = True
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status_url': f"/api/jobs/{job.id}"
+    }), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Report stage, percent and (once finished) the video path for a job."""
+    job = jobs.get_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/retry', methods=['POST'])
+def retry_job(job_id):
+    """
+    Resume an interrupted or failed job, or regenerate selected slides of a finished one.
+    Optional JSON body: {"slides": [3, 7]}; defaults to the slides that failed.
+    Selected slides get a fresh script from the model (the script caches are skipped for
+    them, and new audio and video follow from the new text); failed slides redo only what
+    is missing. Everything else already checkpointed is reused.
+    """
+    api_key = session.get('api_key') or request.headers.get('X-API-Key')
+    if not api_key:
+        return jsonify({"error": "API key not set"}), 401
+
+    job = jobs.get_job(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    if not job.finished:
+        return jsonify({"error": "Job is still running"}), 409
+    if not os.path.exists(job.params.get('pdf_path', '')):
+        return jsonify({"error": "Job files were already cleaned up; upload the PDF again"}), 410
+
+    data = request.get_json(silent=True) or {}
+    try:
+        slides = [int(number) for number in data.get('slides') or job.failed_slide_numbers()]
+    except (TypeError, ValueError):
+        return jsonify({"error": "slides must be a list of slide numbers"}), 400
+
+    job.reset_slides(slides, regenerate=bool(data.get('slides')))
+    job.update(status="queued", stage="Queued", progress=0, error=None, failed_slides=[])
+    jobs.submit_job(job, process_upload, job, api_key=api_key, **job.params)
+
+    session['job_id'] = job.id
+    session.modified = True
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'retried_slides': slides,
+        'status_url': f"/api/jobs/{job.id}"
+    }), 202
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters of the artifact and LLM response caches."""
+    return jsonify({
+        "artifacts": cache.artifact_cache.stats(),
+        "llm": llm_cache.stats()
+    })
+
+@app.route('/client_stats', methods=['GET'])
+def client_stats():
+    """Calls, retries, throttles, concurrency limits and connection reuse of the OpenAI client layer."""
+    return jsonify({"limits": clients.stats(), "connections": clients.client_stats()})
+
 @app.route("/download_video", methods=["GET"])
 def download_video():
     if "api_key" not in session:
@@ -510,9 +1335,10 @@ def clear_session():
     if request.method == "OPTIONS":
         return jsonify({"success": True}), 200
     
+    job_ids = session.get('job_ids', [])
     session.clear()
-    # remove all leftover files.
-    clean_directories(keep_video=None)
+    # remove leftover files of this session's jobs
+    clean_directories(job_ids)
 
     global qa_chain, content_filter, scripts_global
     qa_chain = None
@@ -523,18 +1349,16 @@ def clear_session():
 
 @app.route('/progress')
 def get_progress():
+    """Progress of the most recent upload in this session."""
+    job = jobs.get_job(session.get('job_id', ''))
+    if not job:
+        return jsonify({'stage': 'Starting processing', 'progress': 0, 'details': ''})
     return jsonify({
-        'stage': session.get('current_stage', 'Starting processing'),
-        'progress': session.get('progress', 0),
-        'details': session.get('stage_details', '')
+        'stage': job.stage,
+        'progress': job.progress,
+        'details': job.details
     })
 
-def update_progress(stage, progress, details=""):
-    session['current_stage'] = stage
-    session['progress'] = progress
-    session['stage_details'] = details
-    session.modified = True
-
 # chat QA
 @app.route("/ask", methods=["POST", "OPTIONS"])
 def ask():
@@ -568,8 +1392,12 @@ def ask():
             if safety_instructions:
                 setup_qa_for_chat(scripts_global, api_key, safety_instructions)
         
-        answer = qa_chain.invoke(user_question)
-        return jsonify({"success": True, "answer": answer})
+        # the same question about the same lecture gets the cached answer
+        normalized_question = " ".join(user_question.lower().split())
+        answer, cached = llm_cache.get_or_call(
+            "qa", (qa_fingerprint, normalized_question), lambda: qa_chain.invoke(user_question)
+        )
+        return jsonify({"success": True, "answer": answer, "cached": cached})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -603,15 +1431,21 @@ def update_qa_settings():
     
     return jsonify({"success": True, "message": "QA settings updated"})
 
-def setup_qa_for_chat(scripts, api_key, safety_instructions=None):
-    """Sets up a simple QA system using a vectorstore + OpenAI."""
-    global qa_chain, content_filter, scripts_global
+def setup_qa_for_chat(scripts, api_key, safety_instructions=None, threshold=None):
+    """
+    Sets up a simple QA system using a vectorstore + OpenAI.
+    threshold defaults to the session setting when called inside a request.
+    """
+    global qa_chain, content_filter, scripts_global, qa_fingerprint
 
     print(f"[QA Setup] Setting up QA chain with safety instructions: {bool(safety_instructions)}")
+    # never leave the previous lecture's chain answering if this setup fails
+    qa_chain = None
     
     scripts_global = scripts
     try:
-        threshold = session.get('qa_threshold', 0.04)
+        if threshold is None:
+            threshold = session.get('qa_threshold', 0.04) if has_request_context() else 0.04
         print(f"[QA Setup] Creating content filter with threshold: {threshold}")
         content_filter = create_content_filter(scripts, threshold)
     except Exception as e:
@@ -619,7 +1453,7 @@ def setup_qa_for_chat(scripts, api_key, safety_instructions=None):
         content_filter = lambda _: True
     
     # retrieval QA
-    embeddings = OpenAIEmbeddings(api_key=api_key)
+    embeddings = OpenAIEmbeddings(api_key=api_key, check_embedding_ctx_length=EMBEDDINGS_COUNT_TOKENS)
     vector_store = FAISS.from_texts(scripts, embeddings)
     retriever = vector_store.as_retriever(search_kwargs={"k": 3})
     llm = OpenAI(api_key=api_key)
@@ -651,6 +1485,7 @@ If the question requires further explanation beyond what is in the provided lect
         | StrOutputParser()
     )
     qa_chain = chain
+    qa_fingerprint = cache.hash_key(base_prompt, llm.model_name, *scripts)
     print("[QA Setup] QA chain setup complete")
 
 def create_content_filter(scripts, threshold=0.04):
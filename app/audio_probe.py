@@ -0,0 +1,255 @@
+# shared module: edit src/Shared/audio_probe.py and run src/Shared/sync.py to update the copies
+import os
+import json
+import struct
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from audio_join import frame_header, id3v2_size
+
+# durations recorded when the audio was written, next to the files they describe
+SIDECAR_NAME = "durations.json"
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".aac", ".m4a")
+# ffprobe processes run at once when parsing fails for several files of a directory
+FFPROBE_WORKERS = min(4, os.cpu_count() or 1)
+
+_sidecar_lock = threading.Lock()
+
+# ADTS sampling frequency table, indexed by the header field
+_AAC_SAMPLE_RATES = (96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000, 7350)
+
+
+def mp3_duration(data):
+    """
+    Seconds of MP3 audio in data. Uses the Xing/Info/VBRI frame count when the first
+    frame carries one, otherwise adds up the samples of every frame, so VBR and
+    concatenated streams come out right. None if data holds no MP3 frames.
+    """
+    offset = id3v2_size(data)
+    first = frame_header(data, offset)
+    if first is None:
+        return None
+    length, samples, sample_rate, side_info = first
+    xing = offset + 4 + side_info
+    frames = stream_bytes = None
+    trimmed = 0
+    if data[xing:xing + 4] in (b"Xing", b"Info") and len(data) >= xing + 16:
+        flags, = struct.unpack(">I", data[xing + 4:xing + 8])
+        fields = struct.unpack(">II", data[xing + 8:xing + 16])
+        if flags & 1:
+            frames = fields[0]
+        if flags & 2:
+            stream_bytes = fields[1] if flags & 1 else fields[0]
+        # LAME/Lavc tag after the Xing fields: encoder delay and padding, in samples
+        tag = xing + 8 + 4 * bool(flags & 1) + 4 * bool(flags & 2) + 100 * bool(flags & 4) + 4 * bool(flags & 8)
+        if data[tag:tag + 4] in (b"LAME", b"Lavf", b"Lavc") and len(data) >= tag + 24:
+            delay_padding = data[tag + 21:tag + 24]
+            trimmed = (delay_padding[0] << 4 | delay_padding[1] >> 4) + ((delay_padding[1] & 0x0F) << 8 | delay_padding[2])
+    elif data[offset + 36:offset + 40] == b"VBRI" and len(data) >= offset + 54:
+        stream_bytes, frames = struct.unpack(">II", data[offset + 46:offset + 54])
+    if frames is not None or data[xing:xing + 4] in (b"Xing", b"Info"):
+        # the header frame holds no audio
+        tagged_start, offset = offset, offset + length
+        # trust the header's count only if it describes the whole file (not, say, the
+        # first of several naively concatenated streams)
+        if frames and (stream_bytes is None or abs(stream_bytes - (len(data) - tagged_start)) <= 0.01 * stream_bytes):
+            return max(0, frames * samples - trimmed) / sample_rate
+
+    seconds = 0.0
+    while offset < len(data):
+        frame = frame_header(data, offset)
+        if frame is None:
+            # junk between frames (or a trailing tag): resynchronize on the next frame
+            offset = data.find(b"\xff", offset + 1)
+            if offset < 0:
+                break
+            continue
+        length, samples, sample_rate, _ = frame
+        if offset + length > len(data):
+            # truncated last frame
+            break
+        seconds += samples / sample_rate
+        offset += length
+    return seconds
+
+
+def aac_duration(data):
+    """Seconds of ADTS AAC audio in data (1024 samples per raw block), or None."""
+    offset = id3v2_size(data)
+    seconds = 0.0
+    found = False
+    while offset + 7 <= len(data):
+        if data[offset] != 0xFF or data[offset + 1] & 0xF6 != 0xF0:
+            offset = data.find(b"\xff", offset + 1)
+            if offset < 0:
+                break
+            continue
+        rate_index = (data[offset + 2] >> 2) & 0x0F
+        length = (data[offset + 3] & 0x03) << 11 | data[offset + 4] << 3 | data[offset + 5] >> 5
+        if rate_index >= len(_AAC_SAMPLE_RATES) or length < 7 or offset + length > len(data):
+            break
+        blocks = (data[offset + 6] & 0x03) + 1
+        seconds += 1024 * blocks / _AAC_SAMPLE_RATES[rate_index]
+        found = True
+        offset += length
+    return seconds if found else None
+
+
+def wav_duration(data):
+    """Seconds of PCM in a RIFF/WAVE file, from its fmt and data chunks, or None."""
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        return None
+    offset = 12
+    block_align = sample_rate = None
+    while offset + 8 <= len(data):
+        chunk_id = data[offset:offset + 4]
+        size = struct.unpack("<I", data[offset + 4:offset + 8])[0]
+        if chunk_id == b"fmt ":
+            sample_rate, = struct.unpack("<I", data[offset + 12:offset + 16])
+            block_align, = struct.unpack("<H", data[offset + 20:offset + 22])
+        elif chunk_id == b"data" and block_align and sample_rate:
+            # streamed WAVs leave the size at 0 or 0xFFFFFFFF; the data runs to the end
+            available = len(data) - offset - 8
+            if size in (0, 0xFFFFFFFF) or size > available:
+                size = available
+            return size // block_align / sample_rate
+        offset += 8 + size + (size & 1)
+    return None
+
+
+def mp4_duration(data):
+    """Seconds from the mvhd box of an MP4/M4A file, or None."""
+    offset = 0
+    end = len(data)
+    while offset + 8 <= end:
+        size, box = struct.unpack(">I4s", data[offset:offset + 8])
+        header = 8
+        if size == 1:
+            size, = struct.unpack(">Q", data[offset + 8:offset + 16])
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header:
+            return None
+        if box == b"moov":
+            # descend into the movie box
+            end = offset + size
+            offset += header
+            continue
+        if box == b"mvhd":
+            body = offset + header
+            if data[body] == 1:
+                timescale, duration = struct.unpack(">IQ", data[body + 20:body + 32])
+            else:
+                timescale, duration = struct.unpack(">II", data[body + 12:body + 20])
+            return duration / timescale if timescale else None
+        offset += size
+    return None
+
+
+def parse_duration(data):
+    """Duration of an in-memory MP3, AAC (ADTS), WAV or M4A file, sniffed from its bytes; None if unknown."""
+    if data[:4] == b"RIFF":
+        return wav_duration(data)
+    if data[4:8] == b"ftyp":
+        return mp4_duration(data)
+    start = id3v2_size(data)
+    if data[start:start + 1] == b"\xff" and len(data) > start + 1:
+        # layer bits are 00 for ADTS, 01 for MPEG layer III
+        if data[start + 1] & 0x06 == 0:
+            return aac_duration(data)
+        return mp3_duration(data)
+    return None
+
+
+def ffprobe_duration(path):
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+         '-of', 'default=noprint_wrappers=1:nokey=1', path],
+        capture_output=True,
+        text=True
+    )
+    return float(result.stdout.strip()) if result.stdout.strip() else 0.0
+
+
+def _signature(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _load_sidecar(directory):
+    try:
+        with open(os.path.join(directory, SIDECAR_NAME)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def record_duration(path, duration):
+    """
+    Remember path's duration in its directory's sidecar, keyed by name, size and mtime,
+    so get_duration and probe_directory never read the file again while it is unchanged.
+    """
+    directory, name = os.path.split(path)
+    size, mtime = _signature(path)
+    with _sidecar_lock:
+        entries = _load_sidecar(directory)
+        entries[name] = {"duration": duration, "size": size, "mtime": mtime}
+        sidecar = os.path.join(directory, SIDECAR_NAME)
+        with open(f"{sidecar}.tmp", "w") as f:
+            json.dump(entries, f)
+        os.replace(f"{sidecar}.tmp", sidecar)
+    return duration
+
+
+def _recorded(path, entries):
+    entry = entries.get(os.path.basename(path))
+    if entry and (entry["size"], entry["mtime"]) == _signature(path):
+        return entry["duration"]
+    return None
+
+
+def _read_duration(path):
+    with open(path, "rb") as f:
+        return parse_duration(f.read())
+
+
+def get_duration(path):
+    """
+    Duration of an audio file in seconds: recorded at write time, else parsed in-process,
+    else (unknown or damaged file) asked of ffprobe.
+    """
+    duration = _recorded(path, _load_sidecar(os.path.dirname(path)))
+    if duration is None:
+        duration = _read_duration(path)
+    if duration is None:
+        duration = ffprobe_duration(path)
+    return duration
+
+
+def probe_directory(directory, extensions=AUDIO_EXTENSIONS):
+    """
+    {file name: seconds} for every audio file in directory. The sidecar is read once,
+    files are parsed in-process, and only the ones that cannot be parsed go to ffprobe,
+    a few at a time.
+    """
+    entries = _load_sidecar(directory)
+    durations = {}
+    unknown = []
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith(extensions):
+            continue
+        path = os.path.join(directory, name)
+        duration = _recorded(path, entries)
+        if duration is None:
+            duration = _read_duration(path)
+        if duration is None:
+            unknown.append(name)
+        else:
+            durations[name] = duration
+    if unknown:
+        with ThreadPoolExecutor(max_workers=FFPROBE_WORKERS) as executor:
+            paths = [os.path.join(directory, name) for name in unknown]
+            durations.update(zip(unknown, executor.map(ffprobe_duration, paths)))
+    return durations
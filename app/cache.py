@@ -0,0 +1,168 @@
+import os
+import uuid
+import shutil
+import hashlib
+import threading
+
+CACHE_ROOT = os.getenv("MAESTRO_CACHE_DIR", os.path.join("output", "cache"))
+CACHE_MAX_BYTES = int(os.getenv("MAESTRO_CACHE_MAX_MB", "2048")) * 1024 * 1024
+
+
+def hash_key(*parts):
+    """
+    Stable SHA-256 over an ordered list of str/bytes/number parts.
+    Each part is length-prefixed so ("ab", "c") and ("a", "bc") never collide.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        elif not isinstance(part, (bytes, bytearray, memoryview)):
+            part = repr(part).encode("utf-8")
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ArtifactCache:
+    """
+    Disk-backed, content-addressed store shared by all jobs.
+
+    Entries live at <root>/<kind>/<key[:2]>/<key><suffix>. Reads bump the file's mtime,
+    and once the cache grows past max_bytes the least recently used entries are deleted.
+    """
+
+    def __init__(self, root=CACHE_ROOT, max_bytes=CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = {}
+        self.misses = {}
+        self._lock = threading.Lock()
+        # measured once here so stats() always has a number; kept current by puts and evict()
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def _path(self, kind, key, suffix=""):
+        return os.path.join(self.root, kind, key[:2], f"{key}{suffix}")
+
+    def _count(self, counter, kind):
+        with self._lock:
+            counter[kind] = counter.get(kind, 0) + 1
+
+    def contains(self, kind, key, suffix=""):
+        """True if the entry exists; unlike get() it is not counted as a hit or miss."""
+        return os.path.exists(self._path(kind, key, suffix))
+
+    def get(self, kind, key, suffix=""):
+        """Path of a cached entry, or None on a miss."""
+        path = self._path(kind, key, suffix)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self._count(self.misses, kind)
+            return None
+        self._count(self.hits, kind)
+        return path
+
+    def get_text(self, kind, key):
+        path = self.get(kind, key, ".txt")
+        if path is None:
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            # evicted between get() and open()
+            return None
+
+    def fetch(self, kind, key, dest_path, suffix=""):
+        """
+        Materialize a cached entry at dest_path (hard link, or copy across filesystems).
+        Returns dest_path on a hit, None on a miss.
+        """
+        path = self.get(kind, key, suffix)
+        if path is None:
+            return None
+        tmp_path = f"{dest_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            try:
+                os.link(path, tmp_path)
+            except OSError:
+                shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, dest_path)
+        except FileNotFoundError:
+            return None
+        return dest_path
+
+    def put_file(self, kind, key, src_path, suffix=""):
+        """Copy src_path into the cache. Returns the cache path."""
+        path = self._path(kind, key, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, path)
+        self._added(os.path.getsize(path))
+        return path
+
+    def put_bytes(self, kind, key, data, suffix=""):
+        path = self._path(kind, key, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._added(len(data))
+        return path
+
+    def put_text(self, kind, key, text):
+        return self.put_bytes(kind, key, text.encode("utf-8"), ".txt")
+
+    def _entries(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def _added(self, nbytes):
+        with self._lock:
+            self._size += nbytes
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until the cache is below 90% of max_bytes."""
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry[2])
+            total = sum(size for _, size, _ in entries)
+            target = int(self.max_bytes * 0.9)
+            for path, size, _ in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except FileNotFoundError:
+                    pass
+            self._size = total
+
+    def stats(self):
+        with self._lock:
+            return {"hits": dict(self.hits), "misses": dict(self.misses), "bytes": self._size}
+
+
+artifact_cache = ArtifactCache()
@@ -0,0 +1,387 @@
+import os
+import time
+import random
+import hashlib
+import threading
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+# per API key limits, shared by every job in the process (set them to the account's tier)
+OPENAI_RPM = int(os.getenv("MAESTRO_OPENAI_RPM", "500"))
+OPENAI_TPM = int(os.getenv("MAESTRO_OPENAI_TPM", "30000"))
+TTS_RPM = int(os.getenv("MAESTRO_TTS_RPM", "50"))
+# upper bound for calls in flight per key and kind; lowered automatically while we get 429s
+MAX_CONCURRENCY = int(os.getenv("MAESTRO_OPENAI_CONCURRENCY", "8"))
+MAX_RETRIES = int(os.getenv("MAESTRO_OPENAI_MAX_RETRIES", "6"))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+# rough token cost of an image when estimating a request for the tokens/minute bucket
+IMAGE_TOKENS = {"low": 85, "high": 765}
+# pooled clients unused for this long are closed along with their connections
+CLIENT_IDLE_SECONDS = int(os.getenv("MAESTRO_CLIENT_IDLE_SECONDS", "300"))
+# keep-alive connections per key; several jobs share them
+CLIENT_MAX_CONNECTIONS = int(os.getenv("MAESTRO_CLIENT_MAX_CONNECTIONS", "20"))
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class TokenBucket:
+    """Refills at per_minute/60 units per second up to capacity; acquire() blocks until enough are available."""
+
+    def __init__(self, per_minute, capacity=None):
+        self.rate = max(per_minute, 1) / 60.0
+        self.capacity = capacity or max(per_minute, 1)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1):
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.level >= amount:
+                    self.level -= amount
+                    return
+                wait = (amount - self.level) / self.rate
+            time.sleep(min(wait, 1.0))
+
+    def adjust(self, amount):
+        """Charge (positive) or refund (negative) units once the real cost is known."""
+        with self._lock:
+            self._refill()
+            self.level = min(self.capacity, self.level - amount)
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD limit on calls in flight: halved whenever a call is throttled, raised by one
+    after as many consecutive successes as the current limit.
+    """
+
+    def __init__(self, maximum):
+        self.maximum = max(1, maximum)
+        self.limit = self.maximum
+        self.active = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.active >= self.limit:
+                self._condition.wait()
+            self.active += 1
+
+    def release(self, throttled=False):
+        with self._condition:
+            self.active -= 1
+            if throttled:
+                self.limit = max(1, self.limit // 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self._successes = 0
+            self._condition.notify_all()
+
+
+class Limiter:
+    """Rate limits, concurrency and counters for one API key and kind of call."""
+
+    def __init__(self, rpm, tpm=None):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.concurrency = AdaptiveConcurrency(MAX_CONCURRENCY)
+        self.resume_at = 0.0
+        self.stats = {"calls": 0, "retries": 0, "throttled": 0, "failures": 0}
+        self._lock = threading.Lock()
+
+    def pause(self, seconds):
+        """Hold back every caller on this key, e.g. for a Retry-After."""
+        with self._lock:
+            self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+
+    def wait(self):
+        while True:
+            with self._lock:
+                delay = self.resume_at - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+
+def _limiter(api_key, kind):
+    key = (_key_id(api_key), kind)
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = Limiter(TTS_RPM) if kind == "tts" else Limiter(OPENAI_RPM, OPENAI_TPM)
+            _limiters[key] = limiter
+        return limiter
+
+
+def stats():
+    """Counters and current concurrency limit per (key prefix, kind)."""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {
+        f"{key}/{kind}": dict(limiter.stats, concurrency_limit=limiter.concurrency.limit)
+        for (key, kind), limiter in limiters.items()
+    }
+
+
+def _key_id(api_key):
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+
+
+class _CountedStream(httpx.SyncByteStream):
+    """Response body that reports when it is closed, i.e. when the connection is free again."""
+
+    def __init__(self, stream, on_close):
+        self.stream = stream
+        self.on_close = on_close
+
+    def __iter__(self):
+        yield from self.stream
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            on_close, self.on_close = self.on_close, None
+            if on_close:
+                on_close()
+
+
+class _CountingTransport(httpx.BaseTransport):
+    """
+    Transport wrapper behind PooledClient's in_flight count: a request counts from the
+    moment it is sent until its response body is closed, and a request that fails (connect
+    error, timeout) stops counting right away.
+    """
+
+    def __init__(self, transport, count):
+        self.transport = transport
+        self.count = count
+
+    def handle_request(self, request):
+        self.count("in_flight")
+        try:
+            response = self.transport.handle_request(request)
+        except BaseException:
+            self.count("in_flight", -1)
+            raise
+        response.stream = _CountedStream(response.stream, lambda: self.count("in_flight", -1))
+        return response
+
+    def close(self):
+        self.transport.close()
+
+
+class PooledClient:
+    """
+    One OpenAI client per API key on a long-lived httpx connection pool, so TCP and TLS
+    handshakes happen once per connection rather than once per slide. Connection setup is
+    counted through httpx's trace extension.
+    """
+
+    def __init__(self, api_key):
+        from openai import OpenAI
+        self.stats = {"requests": 0, "connections": 0, "tls_handshakes": 0, "in_flight": 0, "leases": 0}
+        self.last_used = time.monotonic()
+        self._lock = threading.Lock()
+        transport = httpx.HTTPTransport(
+            limits=httpx.Limits(max_connections=CLIENT_MAX_CONNECTIONS,
+                                max_keepalive_connections=CLIENT_MAX_CONNECTIONS,
+                                keepalive_expiry=CLIENT_IDLE_SECONDS)
+        )
+        self.http_client = httpx.Client(
+            transport=_CountingTransport(transport, self._count),
+            timeout=httpx.Timeout(600.0, connect=10.0),
+            event_hooks={"request": [self._on_request]},
+        )
+        # retries are scheduled by call(), which knows about the other jobs on this key
+        self.openai = OpenAI(api_key=api_key, http_client=self.http_client, max_retries=0)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+            self.last_used = time.monotonic()
+
+    def _trace(self, event, info):
+        if event == "connection.connect_tcp.complete":
+            self._count("connections")
+        elif event == "connection.start_tls.complete":
+            self._count("tls_handshakes")
+
+    def _on_request(self, request):
+        request.extensions["trace"] = self._trace
+        self._count("requests")
+
+    def idle(self, now):
+        with self._lock:
+            return (self.stats["in_flight"] <= 0 and self.stats["leases"] <= 0
+                    and now - self.last_used > CLIENT_IDLE_SECONDS)
+
+    def close(self):
+        self.http_client.close()
+
+
+def openai_client(api_key):
+    """Shared OpenAI client for api_key. Clients idle for CLIENT_IDLE_SECONDS are closed."""
+    now = time.monotonic()
+    key = _key_id(api_key)
+    with _clients_lock:
+        idle = [k for k, pooled in _clients.items() if k != key and pooled.idle(now)]
+        evicted = [_clients.pop(k) for k in idle]
+        pooled = _clients.get(key)
+        if pooled is None:
+            pooled = _clients[key] = PooledClient(api_key)
+        pooled.last_used = now
+    for stale in evicted:
+        stale.close()
+    return pooled.openai
+
+
+@contextmanager
+def _lease(api_key):
+    """
+    Keep api_key's pooled client from being evicted while a call() holds it, including the
+    time spent waiting on limits and backoff, when nothing is in flight on it yet.
+    """
+    with _clients_lock:
+        pooled = _clients.get(_key_id(api_key))
+        if pooled:
+            pooled._count("leases")
+    try:
+        yield
+    finally:
+        if pooled:
+            pooled._count("leases", -1)
+
+
+def client_stats():
+    """Requests vs. new connections and TLS handshakes per pooled key; requests - connections were reused."""
+    with _clients_lock:
+        pooled = dict(_clients)
+    result = {}
+    for key, client in pooled.items():
+        with client._lock:
+            stats = dict(client.stats)
+        stats["reused"] = max(0, stats["requests"] - stats["connections"])
+        result[key] = stats
+    return result
+
+
+def estimate_chat_tokens(messages, max_tokens=0):
+    """Upper-bound guess of a chat request's tokens: text at ~4 chars/token, images per detail level."""
+    tokens = max_tokens or 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += len(content) // 4 + 4
+            continue
+        for part in content or []:
+            if part.get("type") == "image_url":
+                tokens += IMAGE_TOKENS.get(part["image_url"].get("detail"), IMAGE_TOKENS["high"])
+            else:
+                tokens += len(part.get("text", "")) // 4
+    return tokens
+
+
+def _retry_after(error):
+    """Seconds the server asked us to wait, if it said so."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if value:
+            try:
+                return float(value)
+            except ValueError:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def _classify(error):
+    """(retryable, throttled) for an exception raised by the OpenAI SDK."""
+    import openai
+    if isinstance(error, openai.RateLimitError):
+        # an exhausted quota does not come back by waiting
+        return getattr(error, "code", None) != "insufficient_quota", True
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)):
+        return True, False
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409) or error.status_code >= 500, False
+    return False, False
+
+
+def call(kind, api_key, fn, tokens=0):
+    """
+    Run fn() (one OpenAI request) under the key's limits for kind ("chat" or "tts"):
+    token buckets for requests/min and, for chat, tokens/min (tokens is the estimate),
+    plus the adaptive concurrency limit. Rate limits, timeouts and 5xx errors are retried
+    with exponential backoff and full jitter, or after the server's Retry-After.
+    Anything else, or running out of retries, re-raises.
+    fn should use the client from openai_client(api_key), fetched right before: it is
+    leased for the whole call, so it is not closed as idle while the call waits.
+    """
+    with _lease(api_key):
+        return _call(kind, api_key, fn, tokens)
+
+
+def _call(kind, api_key, fn, tokens):
+    limiter = _limiter(api_key, kind)
+    attempt = 0
+    while True:
+        limiter.wait()
+        limiter.requests.acquire()
+        if tokens and limiter.tokens:
+            limiter.tokens.acquire(tokens)
+        limiter.concurrency.acquire()
+        throttled = False
+        try:
+            limiter.count("calls")
+            result = fn()
+        except Exception as e:
+            retryable, throttled = _classify(e)
+            if throttled:
+                limiter.count("throttled")
+            if not retryable or attempt >= MAX_RETRIES:
+                limiter.count("failures")
+                raise
+            delay = _retry_after(e)
+            if delay is None:
+                delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+            if throttled:
+                limiter.pause(delay)
+            attempt += 1
+            limiter.count("retries")
+            print(f"OpenAI {kind} call failed ({e.__class__.__name__}), retry {attempt}/{MAX_RETRIES} in {delay:.1f}s")
+        else:
+            usage = getattr(result, "usage", None)
+            if tokens and limiter.tokens and getattr(usage, "total_tokens", None):
+                limiter.tokens.adjust(usage.total_tokens - tokens)
+            return result
+        finally:
+            limiter.concurrency.release(throttled)
+        time.sleep(delay)
@@ -139,14 +139,30 @@ export default function Home() {
           throw new Error(data.error || 'Error uploading file');
         }
         
-        if (data.success && data.video_path) {
-          const videoUrl = data.video_path.replace('/api', backendUrl);
-          setVideoUrl(videoUrl);
-          setShowChat(true);
-          setError('');
-        } else {
+        if (!data.success || !data.job_id) {
           throw new Error('Invalid response from server');
         }
+
+        // the backend processes the deck in the background; poll the job until it finishes
+        let job = data;
+        while (job.status !== 'done') {
+          if (job.status === 'failed' || job.status === 'interrupted') {
+            throw new Error(job.error || 'Video generation failed');
+          }
+          await new Promise((resolve) => setTimeout(resolve, 2000));
+          const statusResponse = await fetch(`${API_CONFIG.baseURL}/jobs/${data.job_id}`,
+            getFetchOptions('GET')
+          );
+          job = await statusResponse.json();
+          if (!statusResponse.ok) {
+            throw new Error(job.error || 'Error checking job status');
+          }
+        }
+
+        const videoUrl = job.video_path.replace('/api', backendUrl);
+        setVideoUrl(videoUrl);
+        setShowChat(true);
+        setError('');
       } catch (error) {
         setError(error instanceof Error ? error.message : 'Error uploading file');
       } finally {
@@ -0,0 +1,98 @@
+import os
+import re
+import threading
+from collections import deque
+
+# context carried from slide to slide when scripting sequentially: the last HISTORY_KEEP
+# scripts verbatim, older ones as a one-line-per-slide summary, all within HISTORY_TOKEN_BUDGET
+HISTORY_KEEP = int(os.getenv("MAESTRO_SLIDE_WINDOW", "4"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("MAESTRO_HISTORY_TOKENS", "1500"))
+SUMMARY_MAX_CHARS = 200
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def count_tokens(text):
+    """Token count of text for the script model, or a chars/4 estimate without tiktoken."""
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            try:
+                import tiktoken
+                _encoding = tiktoken.get_encoding("o200k_base")
+            except Exception:
+                # tiktoken missing, or its encoding file cannot be downloaded
+                _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return (len(text) + 3) // 4
+
+
+def first_sentence(text, max_chars=SUMMARY_MAX_CHARS):
+    sentence = _SENTENCE_END.split(text.strip(), 1)[0]
+    if len(sentence) > max_chars:
+        sentence = sentence[:max_chars].rsplit(" ", 1)[0] + "..."
+    return sentence
+
+
+class ScriptHistory:
+    """
+    Bounded context for sequential script generation.
+
+    Earlier slides are only ever carried as text, never as images: the last `keep` scripts
+    verbatim and every older one as its first sentence in a running summary. Once the
+    context exceeds token_budget, the oldest summary lines go first (the first slide's line,
+    which names the topic, is kept), then the oldest verbatim scripts. Per-slide prompt cost
+    therefore stays flat however long the deck is.
+    """
+
+    def __init__(self, keep=HISTORY_KEEP, token_budget=HISTORY_TOKEN_BUDGET):
+        self.keep = max(0, keep)
+        self.token_budget = token_budget
+        self.recent = deque()  # (slide number, script)
+        self.summary = []  # (slide number, first sentence)
+
+    def add(self, slide_number, script_text):
+        script_text = (script_text or "").strip()
+        if not script_text:
+            return
+        self.recent.append((slide_number, script_text))
+        while len(self.recent) > self.keep:
+            self._fold()
+        while self.tokens() > self.token_budget:
+            if len(self.summary) > 1:
+                del self.summary[1]
+            elif self.recent:
+                self._fold()
+                if len(self.summary) > 1:
+                    del self.summary[1]
+            else:
+                break
+
+    def _fold(self):
+        number, text = self.recent.popleft()
+        self.summary.append((number, first_sentence(text)))
+
+    def text(self):
+        parts = []
+        if self.summary:
+            parts.append("Summary of the earlier slides:\n" + "\n".join(
+                f"- Slide {number}: {sentence}" for number, sentence in self.summary
+            ))
+        if self.recent:
+            parts.append("Narration of the most recent slides:\n" + "\n\n".join(
+                f"Slide {number}: {text}" for number, text in self.recent
+            ))
+        return "\n\n".join(parts)
+
+    def tokens(self):
+        return count_tokens(self.text())
+
+    def messages(self):
+        """previous_content for generate_slide_script: a single text-only message, or none."""
+        text = self.text()
+        if not text:
+            return []
+        return [{"role": "system", "content": f"The lecture so far.\n\n{text}"}]
@@ -0,0 +1,303 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import threading
+import traceback
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+# number of decks processed at the same time; everything else waits in the queue
+MAX_WORKERS = int(os.getenv("MAESTRO_MAX_WORKERS", "2"))
+# uploads beyond this many unfinished jobs are rejected instead of queued forever
+MAX_PENDING_JOBS = int(os.getenv("MAESTRO_MAX_PENDING_JOBS", "16"))
+# every job gets its own directory tree below this root
+WORKSPACE_ROOT = os.getenv("MAESTRO_WORKSPACE_ROOT", os.path.join("output", "jobs"))
+# progress and per-slide checkpoints reach the manifest at most this often (seconds);
+# status changes are written at once
+SAVE_INTERVAL = float(os.getenv("MAESTRO_MANIFEST_SAVE_INTERVAL", "2"))
+# finished jobs (failed ones included) are forgotten, workspace and video with them, once
+# they have not changed for this many hours (0 keeps them until the count cap applies)
+JOB_TTL_HOURS = float(os.getenv("MAESTRO_JOB_TTL_HOURS", "72"))
+# at most this many finished jobs are kept; the least recently updated go first
+MAX_FINISHED_JOBS = int(os.getenv("MAESTRO_MAX_FINISHED_JOBS", "200"))
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="maestro-job")
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+class JobQueueFull(Exception):
+    """Raised when too many jobs are waiting for a worker."""
+
+
+class Workspace:
+    """
+    Private directory tree for one job, so concurrent uploads never share files.
+    """
+
+    def __init__(self, job_id, root=WORKSPACE_ROOT):
+        # job IDs end up in paths, so only accept real UUIDs
+        self.job_id = str(uuid.UUID(job_id))
+        self.root = os.path.join(root, self.job_id)
+        self.upload_dir = os.path.join(self.root, "upload")
+        self.images_dir = os.path.join(self.root, "images")
+        # downscaled JPEGs for the vision model; images_dir holds the video-resolution PNGs
+        self.vision_dir = os.path.join(self.root, "vision")
+        self.scripts_dir = os.path.join(self.root, "scripts")
+        self.audio_dir = os.path.join(self.root, "audio")
+        self.segments_dir = os.path.join(self.root, "segments")
+
+        self.manifest_path = os.path.join(self.root, "manifest.json")
+
+    @property
+    def artifact_dirs(self):
+        return (self.upload_dir, self.images_dir, self.vision_dir, self.scripts_dir,
+                self.audio_dir, self.segments_dir)
+
+    def create(self):
+        """Create the directory tree (idempotent) and return self."""
+        for d in self.artifact_dirs:
+            os.makedirs(d, exist_ok=True)
+        return self
+
+    def cleanup(self, dirs=None):
+        """
+        Remove intermediate files (all artifact_dirs, or just dirs) but keep the manifest,
+        so the job's status survives.
+        """
+        for d in dirs or self.artifact_dirs:
+            shutil.rmtree(d, ignore_errors=True)
+
+    def destroy(self):
+        """Remove the whole tree, manifest included."""
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+class Job:
+    """
+    Status record for one upload, shared between the request thread and the worker.
+
+    The job is checkpointed to <workspace>/manifest.json: besides its status it keeps
+    the upload parameters and, per slide, every output completed so far. A retried or
+    restarted job reads the manifest back and only redoes what is missing. Progress and
+    slide checkpoints are written at most every SAVE_INTERVAL seconds, so a crash can cost
+    the last few seconds of work; status changes are written immediately.
+    """
+
+    def __init__(self, job_id=None, params=None):
+        self.id = job_id or str(uuid.uuid4())
+        self.workspace = Workspace(self.id)
+        self.status = "queued"  # queued | running | done | failed | interrupted
+        self.stage = "Queued"
+        self.progress = 0
+        self.details = ""
+        self.video_path = None
+        self.error = None
+        self.failed_slides = []
+        # counters such as vision_calls / vision_calls_avoided
+        self.stats = {}
+        self.created_at = datetime.now().isoformat()
+        self.updated_at = self.created_at
+        # everything process_upload needs to run the job again (never the API key)
+        self.params = params or {}
+        # str(slide number) -> recorded outputs (image_path, script_path, audio_path, ...)
+        self.slides = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._saved_at = 0.0
+
+    def update(self, stage=None, progress=None, details=None, **fields):
+        """Update stage/progress (0-100) and any other public attribute."""
+        with self._lock:
+            if stage is not None:
+                self.stage = stage
+            if progress is not None:
+                self.progress = max(0, min(100, int(progress)))
+            if details is not None:
+                self.details = details
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.updated_at = datetime.now().isoformat()
+        self.save(force="status" in fields)
+
+    def increment(self, name, amount=1):
+        """Bump a per-job counter in stats."""
+        with self._lock:
+            self.stats[name] = self.stats.get(name, 0) + amount
+        self.save(force=False)
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed", "interrupted")
+
+    def slide_record(self, number):
+        """Copy of the outputs recorded for a slide so far."""
+        with self._lock:
+            return dict(self.slides.get(str(number), {}))
+
+    def record_slide(self, number, **outputs):
+        """Checkpoint outputs of a finished stage for one slide."""
+        with self._lock:
+            self.slides.setdefault(str(number), {}).update(outputs)
+        self.save(force=False)
+
+    def reset_slides(self, numbers, keys=("script_path", "audio_path", "duration", "segment_path", "failed"),
+                     regenerate=False):
+        """
+        Forget the given outputs of the given slides so the next run redoes them. With
+        regenerate, the slides are also flagged to skip the script caches, so they get a
+        new script (and therefore new audio and video) instead of the cached one.
+        """
+        with self._lock:
+            for number in numbers:
+                record = self.slides.get(str(number), {})
+                for key in keys:
+                    record.pop(key, None)
+                if regenerate:
+                    self.slides[str(number)] = dict(record, regenerate=True)
+        self.save()
+
+    def failed_slide_numbers(self):
+        with self._lock:
+            return sorted(int(number) for number, record in self.slides.items() if record.get("failed"))
+
+    def _status_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "details": self.details,
+            "video_path": self.video_path,
+            "error": self.error,
+            "failed_slides": list(self.failed_slides),
+            "stats": dict(self.stats),
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+    def to_dict(self):
+        with self._lock:
+            return self._status_dict()
+
+    def save(self, force=True):
+        """
+        Write the manifest atomically; a no-op once the workspace is gone. Without force,
+        nothing is written if the last write is less than SAVE_INTERVAL seconds old; the
+        change goes out with the next write.
+        """
+        if not force and time.monotonic() - self._saved_at < SAVE_INTERVAL:
+            return
+        if not os.path.isdir(self.workspace.root):
+            return
+        with self._save_lock:
+            self._saved_at = time.monotonic()
+            with self._lock:
+                manifest = self._status_dict()
+                manifest["params"] = dict(self.params)
+                manifest["slides"] = {number: dict(record) for number, record in self.slides.items()}
+            tmp_path = f"{self.workspace.manifest_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, separators=(",", ":"))
+            os.replace(tmp_path, self.workspace.manifest_path)
+
+    @classmethod
+    def from_manifest(cls, manifest):
+        job = cls(manifest["job_id"], params=manifest.get("params"))
+        for name in ("status", "stage", "progress", "details", "video_path", "error",
+                     "failed_slides", "stats", "created_at", "updated_at"):
+            if name in manifest:
+                setattr(job, name, manifest[name])
+        job.slides = manifest.get("slides", {})
+        return job
+
+
+def create_job():
+    """Register a new queued job and return it."""
+    with _jobs_lock:
+        pending = sum(1 for job in _jobs.values() if not job.finished)
+        if pending >= MAX_PENDING_JOBS:
+            raise JobQueueFull(f"Too many jobs in progress ({pending}), try again later")
+        job = Job()
+        _jobs[job.id] = job
+    return job
+
+
+def load_jobs(root=WORKSPACE_ROOT):
+    """
+    Re-register jobs checkpointed by a previous process. Jobs that were queued or running
+    when it died are marked interrupted; they can be resumed through a retry.
+    """
+    if not os.path.isdir(root):
+        return 0
+    loaded = 0
+    for name in os.listdir(root):
+        manifest_path = os.path.join(root, name, "manifest.json")
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                job = Job.from_manifest(json.load(f))
+        except (OSError, ValueError, KeyError) as e:
+            if os.path.exists(manifest_path):
+                print(f"Warning: could not load job manifest {manifest_path}: {e}")
+            continue
+        if not job.finished:
+            job.status = "interrupted"
+            job.stage = "Interrupted"
+            job.error = "Server restarted while the job was running; retry to resume it"
+            job.save()
+        with _jobs_lock:
+            _jobs.setdefault(job.id, job)
+        loaded += 1
+    return loaded
+
+
+def prune_jobs(ttl_hours=JOB_TTL_HOURS, keep=MAX_FINISHED_JOBS):
+    """
+    Retention policy: unregister finished jobs older than ttl_hours or beyond the newest
+    keep, and destroy their workspaces. Returns their IDs so the caller can delete the
+    files it owns (videos). Queued and running jobs are never pruned.
+    """
+    now = datetime.now()
+    with _jobs_lock:
+        finished = sorted((job for job in _jobs.values() if job.finished),
+                          key=lambda job: job.updated_at, reverse=True)
+        expired = finished[max(0, keep):]
+        if ttl_hours > 0:
+            expired += [job for job in finished[:max(0, keep)]
+                        if (now - datetime.fromisoformat(job.updated_at)).total_seconds() > ttl_hours * 3600]
+        for job in expired:
+            del _jobs[job.id]
+    for job in expired:
+        job.workspace.destroy()
+    return [job.id for job in expired]
+
+
+def get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def remove_job(job_id):
+    """Unregister a job, e.g. once its files are deleted; returns it (None if unknown)."""
+    with _jobs_lock:
+        return _jobs.pop(job_id, None)
+
+
+def submit_job(job, fn, *args, **kwargs):
+    """
+    Run fn(*args, **kwargs) on the worker pool and track its outcome on job.
+    fn should return the final video path; exceptions mark the job as failed.
+    """
+
+    def run():
+        job.update(status="running", stage="Starting processing", progress=0, error=None)
+        try:
+            video_path = fn(*args, **kwargs)
+            job.update(status="done", stage="Completed", progress=100, video_path=video_path)
+        except Exception as e:
+            traceback.print_exc()
+            job.update(status="failed", stage="Failed", error=str(e))
+
+    return _executor.submit(run)
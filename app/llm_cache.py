@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+import clients
+from cache import artifact_cache, hash_key
+
+# responses older than this are treated as misses; size-based eviction is the artifact cache's LRU
+LLM_CACHE_TTL = int(os.getenv("MAESTRO_LLM_CACHE_TTL", str(30 * 24 * 3600)))
+# set to 0 to always call the model
+LLM_CACHE_ENABLED = os.getenv("MAESTRO_LLM_CACHE", "1") == "1"
+
+_counters = {}
+_counters_lock = threading.Lock()
+
+
+def _count(namespace, outcome):
+    with _counters_lock:
+        counts = _counters.setdefault(namespace, {"hits": 0, "misses": 0, "expired": 0, "bypassed": 0})
+        counts[outcome] += 1
+
+
+def stats():
+    """Hit/miss/expired/bypassed counts per namespace since the process started."""
+    with _counters_lock:
+        return {namespace: dict(counts) for namespace, counts in _counters.items()}
+
+
+def _normalize_content(content):
+    if isinstance(content, str):
+        return content.strip()
+    parts = []
+    for part in content or []:
+        if part.get("type") == "image_url":
+            url = part["image_url"]["url"]
+            if url.startswith("data:"):
+                # hash the image instead of keying on megabytes of base64
+                url = "sha256:" + hashlib.sha256(url.encode("ascii")).hexdigest()
+            parts.append({"type": "image_url", "url": url, "detail": part["image_url"].get("detail")})
+        else:
+            parts.append({key: value.strip() if isinstance(value, str) else value
+                          for key, value in part.items()})
+    return parts
+
+
+def normalize_messages(messages):
+    """Messages reduced to what determines the response: roles, trimmed text, image hashes."""
+    return [{"role": message["role"], "content": _normalize_content(message.get("content"))}
+            for message in messages]
+
+
+def get_or_call(namespace, key_parts, fn, use_cache=True, ttl=LLM_CACHE_TTL, keep=bool):
+    """
+    Return (value, hit): the cached JSON-serializable value for key_parts, or fn()'s result,
+    which is stored if keep(value) is true. use_cache=False (or MAESTRO_LLM_CACHE=0) always
+    calls fn, for calls where a fresh sample is wanted.
+    """
+    if not (use_cache and LLM_CACHE_ENABLED):
+        _count(namespace, "bypassed")
+        return fn(), False
+
+    key = hash_key(namespace, *key_parts)
+    text = artifact_cache.get_text("llm", key)
+    if text is not None:
+        try:
+            entry = json.loads(text)
+            if time.time() - entry["created"] <= ttl:
+                _count(namespace, "hits")
+                return entry["value"], True
+            _count(namespace, "expired")
+        except (ValueError, KeyError):
+            _count(namespace, "misses")
+    else:
+        _count(namespace, "misses")
+
+    value = fn()
+    if keep(value):
+        artifact_cache.put_text("llm", key, json.dumps({"created": time.time(), "value": value}))
+    return value, False
+
+
+def chat_completion(client, use_cache=True, ttl=LLM_CACHE_TTL, on_delta=None, **request):
+    """
+    client.chat.completions.create(**request) through the response cache, keyed by model,
+    sampling parameters and normalized messages. Misses go through the key's rate limiter
+    and retry scheduler (see clients.call). Returns {"content", "usage", "cached"};
+    usage (prompt/completion tokens) is None on a hit since nothing was spent.
+    With on_delta, the response is streamed and on_delta(text) is called for every piece
+    of content as it arrives (once with the whole content on a hit).
+    """
+    def stream():
+        chunks = clients.call(
+            "chat", client.api_key,
+            lambda: client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **request),
+            tokens=clients.estimate_chat_tokens(request["messages"], request.get("max_tokens"))
+        )
+        parts = []
+        usage = None
+        for chunk in chunks:
+            if chunk.usage:
+                usage = {"prompt_tokens": chunk.usage.prompt_tokens,
+                         "completion_tokens": chunk.usage.completion_tokens}
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+                on_delta(parts[-1])
+        return {"content": "".join(parts), "usage": usage}
+
+    def call():
+        response = clients.call(
+            "chat", client.api_key, lambda: client.chat.completions.create(**request),
+            tokens=clients.estimate_chat_tokens(request["messages"], request.get("max_tokens"))
+        )
+        usage = None
+        if response.usage:
+            usage = {"prompt_tokens": response.usage.prompt_tokens,
+                     "completion_tokens": response.usage.completion_tokens}
+        return {"content": response.choices[0].message.content or "", "usage": usage}
+
+    params = {name: value for name, value in request.items() if name != "messages"}
+    result, hit = get_or_call(
+        "chat",
+        (json.dumps(params, sort_keys=True), json.dumps(normalize_messages(request["messages"]), sort_keys=True)),
+        stream if on_delta else call, use_cache=use_cache, ttl=ttl,
+        keep=lambda result: bool(result["content"].strip())
+    )
+    if hit and on_delta:
+        on_delta(result["content"])
+    return {"content": result["content"], "usage": None if hit else result["usage"], "cached": hit}
@@ -0,0 +1,138 @@
+import queue
+import threading
+
+# sentinel that tells a stage worker its input is exhausted
+_DONE = object()
+_POLL_SECONDS = 0.1
+
+
+class Stage:
+    """
+    One step of a pipeline: fn(item) -> item, or None to drop the item.
+    Items are handed to the next stage through a queue of at most maxsize entries,
+    so a slow stage back-pressures the ones in front of it instead of buffering everything.
+    """
+
+    def __init__(self, name, fn, workers=1, maxsize=2):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.maxsize = max(1, maxsize)
+
+
+class PipelineError(RuntimeError):
+    def __init__(self, stage_name, error):
+        super().__init__(f"{stage_name} failed: {error}")
+        self.stage_name = stage_name
+        self.error = error
+
+
+def _put(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=_POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=_POLL_SECONDS)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+def run_pipeline(source, stages, on_item=None):
+    """
+    Push every item of the iterable source through stages, with each stage running
+    in its own worker thread(s). A stage with a single worker sees items in source order.
+
+    on_item(item) is called from the calling thread as items leave the last stage.
+    Returns the finished items in completion order. The first exception raised by the
+    source or any stage stops the whole pipeline and is re-raised as PipelineError.
+    """
+    stop = threading.Event()
+    errors = []
+    errors_lock = threading.Lock()
+
+    # queues[i] feeds stages[i]; the last queue is drained by the caller
+    queues = [queue.Queue(maxsize=stage.maxsize) for stage in stages]
+    queues.append(queue.Queue(maxsize=max(stage.maxsize for stage in stages) if stages else 1))
+    consumers = [stage.workers for stage in stages] + [1]
+    remaining = [stage.workers for stage in stages]
+
+    def fail(name, error):
+        with errors_lock:
+            errors.append((name, error))
+        stop.set()
+
+    def finish(q, count):
+        for _ in range(count):
+            _put(q, _DONE, stop)
+
+    def feed():
+        try:
+            for item in source:
+                if not _put(queues[0], item, stop):
+                    break
+        except Exception as e:
+            fail("source", e)
+        finally:
+            close = getattr(source, "close", None)
+            if close:
+                close()
+        finish(queues[0], consumers[0])
+
+    def work(index):
+        stage = stages[index]
+        while True:
+            item = _get(queues[index], stop)
+            if item is _DONE:
+                break
+            try:
+                result = stage.fn(item)
+            except Exception as e:
+                fail(stage.name, e)
+                break
+            if result is not None and not _put(queues[index + 1], result, stop):
+                break
+        with errors_lock:
+            remaining[index] -= 1
+            last = remaining[index] == 0
+        if last:
+            finish(queues[index + 1], consumers[index + 1])
+
+    threads = [threading.Thread(target=feed, name="pipeline-source", daemon=True)]
+    for index, stage in enumerate(stages):
+        for n in range(stage.workers):
+            threads.append(threading.Thread(
+                target=work, args=(index,), name=f"pipeline-{stage.name}-{n}", daemon=True
+            ))
+    for thread in threads:
+        thread.start()
+
+    results = []
+    try:
+        while True:
+            item = _get(queues[-1], stop)
+            if item is _DONE:
+                break
+            results.append(item)
+            if on_item:
+                on_item(item)
+    except Exception as e:
+        fail("on_item", e)
+    finally:
+        if errors:
+            stop.set()
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        name, error = errors[0]
+        raise PipelineError(name, error) from error
+    return results
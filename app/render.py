@@ -0,0 +1,392 @@
+import os
+import re
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from multiprocessing import shared_memory, resource_tracker
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+import vision
+from cache import hash_key
+
+# pages are rendered straight to the video frame size instead of 300 DPI
+VIDEO_WIDTH = int(os.getenv("MAESTRO_VIDEO_WIDTH", "1920"))
+VIDEO_HEIGHT = int(os.getenv("MAESTRO_VIDEO_HEIGHT", "1080"))
+# "raw" hands page pixels from the render workers through shared memory (copied out and
+# freed as soon as the page reaches the pipeline) and pipes them to ffmpeg; "png" writes
+# page_<n>.png and lets ffmpeg decode it again
+FRAME_INPUT = os.getenv("MAESTRO_FRAME_INPUT", "raw")
+# shared memory blocks are named <prefix><owner pid>_<random>, so blocks left behind by a
+# crashed server can be found and removed (see remove_orphaned_frames)
+SHM_PREFIX = "maestro_"
+SHM_DIR = "/dev/shm"
+# a page counts as figure-heavy above this many vector paths or this share of raster images
+FIGURE_MIN_DRAWINGS = int(os.getenv("MAESTRO_FIGURE_MIN_DRAWINGS", "15"))
+FIGURE_MIN_IMAGE_AREA = 0.05
+# title/outline pages: at most this many lines and words
+TITLE_MAX_LINES = 6
+TITLE_MAX_WORDS = 40
+MATH_CHARS = set("∑∏∫∮√∞≤≥≠≈≡∝∈∉⊂⊆⊃∪∩∀∃∂∇αβγδεζηθλμξπρστφχψωΓΔΘΛΞΠΣΦΨΩ→←⇒⇔↦±×÷⋅")
+MATH_FONTS = re.compile(r"CMMI|CMSY|CMEX|Math|Symbol|STIX|MT ?Extra", re.IGNORECASE)
+# consecutive pages count as near-duplicates (e.g. PowerPoint build steps) when their
+# difference hashes differ in at most this many bits and their thumbnails by at most this
+# mean absolute gray level
+DUPLICATE_MAX_HAMMING = int(os.getenv("MAESTRO_DUPLICATE_MAX_HAMMING", "6"))
+DUPLICATE_MAX_DIFF = float(os.getenv("MAESTRO_DUPLICATE_MAX_DIFF", "8"))
+THUMB_SIZE = (48, 27)
+# rasterization processes shared by all decks, and how many pages one deck may have
+# rendered ahead of its consumer
+RENDER_WORKERS = int(os.getenv("MAESTRO_RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+RENDER_INFLIGHT = int(os.getenv("MAESTRO_RENDER_INFLIGHT", str(2 * RENDER_WORKERS)))
+
+# documents a worker process has open, by path
+WORKER_OPEN_DOCUMENTS = 4
+
+# documents opened by this worker process, and the pid of the server the frames belong to
+_worker_documents = {}
+_worker_owner = None
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _shared_memory(name=None, create=False, size=0):
+    """
+    Open a shared memory block that this process will not unlink at exit; ownership
+    passes from the render worker to whoever calls RawFrame.release().
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    except TypeError:
+        # Python < 3.13 always registers the block with the resource tracker
+        shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class RawFrame:
+    """
+    RGB24 pixels of one rendered page held in shared memory, so the render worker and the
+    encoder share one buffer instead of round-tripping through PNG files. Picklable.
+    """
+
+    def __init__(self, name, width, height):
+        self.name = name
+        self.width = width
+        self.height = height
+
+    @property
+    def size(self):
+        return self.width * self.height * 3
+
+    @contextmanager
+    def buffer(self):
+        """Memoryview over the pixels, valid inside the with block."""
+        shm = _shared_memory(self.name)
+        view = shm.buf[:self.size]
+        try:
+            yield view
+        finally:
+            view.release()
+            shm.close()
+
+    def take(self):
+        """Copy the pixels into a Frame in this process and free the shared memory block."""
+        with self.buffer() as view:
+            pixels = bytes(view)
+        self.release()
+        return Frame(pixels, self.width, self.height)
+
+    def release(self):
+        """Free the shared memory block. Safe to call more than once."""
+        try:
+            try:
+                shm = shared_memory.SharedMemory(name=self.name, track=False)
+            except TypeError:
+                # registered on attach; unlink() below unregisters it again
+                shm = shared_memory.SharedMemory(name=self.name)
+        except FileNotFoundError:
+            return
+        shm.close()
+        shm.unlink()
+
+
+class Frame:
+    """RGB24 pixels of one rendered page in process memory, taken out of a RawFrame."""
+
+    def __init__(self, pixels, width, height):
+        self.pixels = pixels
+        self.width = width
+        self.height = height
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def remove_orphaned_frames():
+    """
+    Unlink shared memory blocks whose owning server is gone (or is a previous process
+    that had this pid). Call once at startup, before any rendering. Returns the count.
+    """
+    if not os.path.isdir(SHM_DIR):
+        return 0
+    removed = 0
+    for name in os.listdir(SHM_DIR):
+        if not name.startswith(SHM_PREFIX):
+            continue
+        owner = name[len(SHM_PREFIX):].split("_", 1)[0]
+        if owner.isdigit() and (int(owner) == os.getpid() or not _pid_alive(int(owner))):
+            try:
+                os.remove(os.path.join(SHM_DIR, name))
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def _mp_context():
+    # forking the threaded Flask server could copy a lock some other thread holds; the fork
+    # server is a clean single-threaded process that imports the main module once (as
+    # __mp_main__, see app.py) and this one, and every worker is forked from it
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["__main__", __name__])
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+def _init_worker(owner):
+    global _worker_owner
+    _worker_owner = owner
+
+
+def _worker_document(pdf_path):
+    """The worker's open copy of pdf_path; decks take turns on the shared pool."""
+    document = _worker_documents.pop(pdf_path, None)
+    if document is None:
+        if len(_worker_documents) >= WORKER_OPEN_DOCUMENTS:
+            # least recently used first
+            _worker_documents.pop(next(iter(_worker_documents))).close()
+        document = fitz.open(pdf_path)
+    _worker_documents[pdf_path] = document
+    return document
+
+
+def start_pool(workers=RENDER_WORKERS):
+    """
+    Create the render process pool (idempotent). Call it at app start, before the server
+    threads are busy; render_pages otherwise creates it on first use.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=max(1, workers),
+                mp_context=_mp_context(),
+                initializer=_init_worker,
+                initargs=(os.getpid(),)
+            )
+        return _pool
+
+
+def _discard_pool(pool):
+    # a worker died: the executor refuses new work, so the next deck gets a fresh pool
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def page_zoom(page_rect, width=VIDEO_WIDTH, height=VIDEO_HEIGHT):
+    """Zoom factor that fits a page into width x height without changing its aspect ratio."""
+    return min(width / page_rect.width, height / page_rect.height)
+
+
+def analyze_page(page):
+    """
+    Classify a page from its text layer alone:
+    - "figure": images, diagrams, equations, or no text layer at all; needs the vision model
+    - "title": a title or short outline
+    - "text": regular text slide that can be narrated from the extracted text
+    Returns {"kind", "text", "lines", "words", "drawings", "image_area"}.
+    """
+    page_area = abs(page.rect) or 1.0
+    lines = []
+    has_math = False
+    data = page.get_text("dict", flags=fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES)
+    for block in data["blocks"]:
+        for line in block.get("lines", []):
+            spans = line["spans"]
+            text = "".join(span["text"] for span in spans).strip()
+            if text:
+                lines.append(text)
+            if any(MATH_FONTS.search(span["font"]) or MATH_CHARS.intersection(span["text"]) for span in spans):
+                has_math = True
+
+    image_area = sum(abs(fitz.Rect(info["bbox"]) & page.rect) for info in page.get_image_info()) / page_area
+    drawings = len(page.get_drawings())
+    words = sum(len(line.split()) for line in lines)
+
+    if not lines or has_math or image_area > FIGURE_MIN_IMAGE_AREA or drawings > FIGURE_MIN_DRAWINGS:
+        kind = "figure"
+    elif len(lines) <= TITLE_MAX_LINES and words <= TITLE_MAX_WORDS:
+        kind = "title"
+    else:
+        kind = "text"
+    return {
+        "kind": kind,
+        "text": "\n".join(lines),
+        "lines": len(lines),
+        "words": words,
+        "drawings": drawings,
+        "image_area": round(image_area, 3),
+    }
+
+
+def fingerprint(image):
+    """64-bit difference hash plus a tiny grayscale thumbnail, for cheap page comparisons."""
+    gray = image.convert("L")
+    small = gray.resize((9, 8), Image.BILINEAR, reducing_gap=2.0).tobytes()
+    dhash = 0
+    for row in range(8):
+        for col in range(8):
+            dhash = (dhash << 1) | (small[row * 9 + col] > small[row * 9 + col + 1])
+    thumb = gray.resize(THUMB_SIZE, Image.BILINEAR, reducing_gap=2.0).tobytes()
+    return {"dhash": dhash, "thumb": thumb.hex()}
+
+
+def file_fingerprint(vision_path):
+    """fingerprint() of a page from its vision image, for pages reused from a checkpoint."""
+    with Image.open(vision_path) as image:
+        return fingerprint(image)
+
+
+def page_delta(previous, current):
+    """
+    Compare two consecutive rendered pages (dicts with fingerprint and analysis).
+    Returns None if they are different slides, otherwise the text lines that current adds
+    to previous (empty when they look the same). Pages with a text layer only match when
+    current keeps every line of previous, as a build step does.
+    """
+    fp_a, fp_b = previous.get("fingerprint"), current.get("fingerprint")
+    if not fp_a or not fp_b:
+        return None
+    hamming = bin(fp_a["dhash"] ^ fp_b["dhash"]).count("1")
+    thumb_a, thumb_b = bytes.fromhex(fp_a["thumb"]), bytes.fromhex(fp_b["thumb"])
+    if hamming > DUPLICATE_MAX_HAMMING or len(thumb_a) != len(thumb_b):
+        return None
+    mean_diff = sum(abs(a - b) for a, b in zip(thumb_a, thumb_b)) / len(thumb_a)
+    if mean_diff > DUPLICATE_MAX_DIFF:
+        return None
+
+    lines_a = previous.get("analysis", {}).get("text", "").splitlines()
+    lines_b = current.get("analysis", {}).get("text", "").splitlines()
+    if not set(lines_a) <= set(lines_b):
+        return None
+    seen = set(lines_a)
+    return [line for line in lines_b if line not in seen]
+
+
+def _render_page(pdf_path, page_number, images_dir, vision_dir, write_png):
+    """
+    Render one page at video resolution inside a worker, plus the page_<n> image sent to the
+    vision model (vision.encode_image at the detail vision.choose_detail picks for the page).
+    The pixels go either to page_<n>.png or, when write_png is false, into a RawFrame.
+    Only paths, the frame handle, the pixel hash and the text-layer analysis travel back.
+    """
+    page = _worker_document(pdf_path)[page_number]
+    zoom = page_zoom(page.rect)
+    pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    samples = pixmap.samples_mv
+    img_data = Image.frombuffer("RGB", (pixmap.width, pixmap.height), samples, "raw", "RGB", 0, 1)
+
+    output_path = None
+    frame = None
+    if write_png:
+        # libx264 with yuv420p needs even dimensions
+        even_size = (pixmap.width - pixmap.width % 2, pixmap.height - pixmap.height % 2)
+        png_image = img_data.crop((0, 0) + even_size) if even_size != img_data.size else img_data
+        output_path = os.path.join(images_dir, f'page_{page_number + 1}.png')
+        png_image.save(output_path, 'PNG')
+    else:
+        shm = _shared_memory(name=f"{SHM_PREFIX}{_worker_owner}_{os.urandom(6).hex()}",
+                             create=True, size=len(samples))
+        shm.buf[:len(samples)] = samples
+        frame = RawFrame(shm.name, pixmap.width, pixmap.height)
+        shm.close()
+
+    analysis = analyze_page(page)
+    vision_path = os.path.join(vision_dir, f'page_{page_number + 1}{vision.FILE_SUFFIX}')
+    data, _ = vision.encode_image(img_data, vision.choose_detail(analysis["kind"]))
+    with open(vision_path, 'wb') as f:
+        f.write(data)
+
+    return {
+        "image_path": output_path,
+        "vision_path": vision_path,
+        "frame": frame,
+        "pixel_hash": hash_key(pixmap.width, pixmap.height, samples),
+        "analysis": analysis,
+        "fingerprint": file_fingerprint(vision_path),
+    }
+
+
+def render_pages(pdf_path, images_dir, vision_dir, page_numbers, write_png=None,
+                 inflight=RENDER_INFLIGHT):
+    """
+    Rasterize the given 0-based pages on the shared process pool (see start_pool), each
+    worker holding its own open copy of the document. Yields (page_number, page) in the order of page_numbers, where
+    page has image_path, vision_path, frame, pixel_hash, analysis (see analyze_page) and
+    fingerprint;
+    image_path is None in raw mode and frame is None in PNG mode (write_png defaults to
+    FRAME_INPUT == "png"). The consumer owns yielded frames and
+    must take() or release() them. At most `inflight` pages are submitted ahead of the consumer,
+    which caps the number of pixmaps alive at once.
+    """
+    if write_png is None:
+        write_png = FRAME_INPUT == "png"
+    page_numbers = list(page_numbers)
+    if not page_numbers:
+        return
+    inflight = max(1, inflight)
+    executor = start_pool()
+
+    def submit(page_number):
+        return executor.submit(_render_page, pdf_path, page_number, images_dir, vision_dir, write_png)
+
+    pending = deque()
+    remaining = iter(page_numbers)
+    try:
+        for page_number in remaining:
+            pending.append((page_number, submit(page_number)))
+            if len(pending) >= inflight:
+                break
+        while pending:
+            page_number, future = pending.popleft()
+            page = future.result()
+            next_page = next(remaining, None)
+            if next_page is not None:
+                pending.append((next_page, submit(next_page)))
+            yield page_number, page
+    except BrokenProcessPool:
+        _discard_pool(executor)
+        raise
+    finally:
+        # frames rendered ahead but never handed out
+        for _, future in pending:
+            if not future.cancel() and future.exception() is None:
+                frame = future.result()["frame"]
+                if frame:
+                    frame.release()
@@ -0,0 +1,118 @@
+import os
+import re
+import wave
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# OpenAI's "pcm" response format: 24 kHz, 16-bit little-endian, mono
+PCM_RATE = 24000
+PCM_SAMPLE_WIDTH = 2
+PCM_CHANNELS = 1
+# sentences are sent to TTS in pieces of at least this many characters; very short
+# requests cost a round-trip each and sound clipped
+MIN_PIECE_CHARS = int(os.getenv("MAESTRO_STREAM_MIN_CHARS", "120"))
+# concurrent TTS requests across all streamed slides (clients.call still applies the key's limits)
+SPEECH_WORKERS = int(os.getenv("MAESTRO_SPEECH_WORKERS", "8"))
+
+_SENTENCE_END = re.compile(r"[.!?]+[\"')\]]*\s+")
+_ABBREVIATIONS = ("e.g.", "i.e.", "etc.", "vs.", "fig.", "eq.", "dr.", "mr.", "ms.", "no.")
+
+_executor = ThreadPoolExecutor(max_workers=SPEECH_WORKERS, thread_name_prefix="maestro-speech")
+
+
+class SentenceSplitter:
+    """
+    Turns a stream of text deltas into pieces of whole sentences. A sentence is complete
+    once the whitespace after its final punctuation has arrived.
+    """
+
+    def __init__(self, min_chars=MIN_PIECE_CHARS):
+        self.min_chars = min_chars
+        self._buffer = ""
+        self._piece = ""
+
+    def feed(self, text):
+        """Add a delta; returns the pieces it completed."""
+        self._buffer += text
+        pieces = []
+        start = 0
+        for match in _SENTENCE_END.finditer(self._buffer):
+            sentence = self._buffer[start:match.end()]
+            if sentence.rstrip().lower().endswith(_ABBREVIATIONS):
+                continue
+            start = match.end()
+            self._piece += sentence
+            if len(self._piece) >= self.min_chars:
+                pieces.append(self._piece.strip())
+                self._piece = ""
+        self._buffer = self._buffer[start:]
+        return pieces
+
+    def flush(self):
+        """The rest of the text, once the stream has ended."""
+        rest = (self._piece + self._buffer).strip()
+        self._piece = self._buffer = ""
+        return [rest] if rest else []
+
+
+class SpeechStream:
+    """
+    Synthesizes a slide's narration piece by piece while its script is still streaming in.
+    synthesize(text) must return raw PCM (see PCM_RATE); pieces run concurrently and are
+    joined in order into one WAV, with no codec padding between them.
+    """
+
+    def __init__(self, synthesize, min_chars=MIN_PIECE_CHARS):
+        self.synthesize = synthesize
+        self.splitter = SentenceSplitter(min_chars)
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def _submit(self, pieces):
+        with self._lock:
+            self._futures.extend(_executor.submit(self.synthesize, piece) for piece in pieces)
+
+    def feed(self, text):
+        """Text delta from the script stream."""
+        self._submit(self.splitter.feed(text))
+
+    @property
+    def pieces(self):
+        with self._lock:
+            return len(self._futures)
+
+    def finish(self, wav_path):
+        """
+        Synthesize the remaining text, wait for every piece and write them to wav_path.
+        Returns the duration in seconds. Raises if any piece failed.
+        """
+        self._submit(self.splitter.flush())
+        with self._lock:
+            futures = list(self._futures)
+        if not futures:
+            raise ValueError("no text to synthesize")
+        tmp_path = f"{wav_path}.tmp"
+        frames = 0
+        try:
+            with wave.open(tmp_path, "wb") as wav:
+                wav.setnchannels(PCM_CHANNELS)
+                wav.setsampwidth(PCM_SAMPLE_WIDTH)
+                wav.setframerate(PCM_RATE)
+                for future in futures:
+                    pcm = future.result()
+                    # an odd byte would shift every following sample
+                    pcm = pcm[:len(pcm) - len(pcm) % (PCM_SAMPLE_WIDTH * PCM_CHANNELS)]
+                    wav.writeframes(pcm)
+                    frames += len(pcm) // (PCM_SAMPLE_WIDTH * PCM_CHANNELS)
+        except Exception:
+            self.cancel()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, wav_path)
+        return frames / PCM_RATE
+
+    def cancel(self):
+        with self._lock:
+            for future in self._futures:
+                future.cancel()
@@ -0,0 +1,123 @@
+import io
+import os
+import math
+import base64
+
+from PIL import Image
+
+# payload format sent to the vision model: "jpeg" or "webp"
+VISION_FORMAT = os.getenv("MAESTRO_VISION_FORMAT", "jpeg").lower()
+VISION_QUALITY = int(os.getenv("MAESTRO_VISION_QUALITY", "80"))
+# "auto" picks the detail level per slide (see choose_detail); "high" or "low" forces one
+VISION_DETAIL = os.getenv("MAESTRO_VISION_DETAIL", "auto")
+# high detail images are billed per 512px tile (170 tokens each, plus 85); a 16:9 slide at
+# 4 tiles is 1024x576, at 6 tiles 1365x768
+VISION_MAX_TILES = int(os.getenv("MAESTRO_VISION_MAX_TILES", "4"))
+TILE_SIZE = 512
+LOW_DETAIL_SIDE = 512
+BASE_TOKENS = 85
+TILE_TOKENS = 170
+
+# the model fits images into 2048x2048 and scales the short side to 768 before tiling;
+# anything larger is downscaled server-side anyway
+VISION_MAX_SIDE = 2048
+VISION_SHORT_SIDE = 768
+
+MIME_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp"}
+IMAGE_FORMAT = VISION_FORMAT if VISION_FORMAT in MIME_TYPES else "jpeg"
+# extension of the page_<n> files render writes for the model
+FILE_SUFFIX = ".jpg" if IMAGE_FORMAT == "jpeg" else f".{IMAGE_FORMAT}"
+
+
+def vision_size(width, height):
+    """Size the model scales an image to before tiling it (never upscaled)."""
+    scale = min(1.0, VISION_MAX_SIDE / max(width, height))
+    scale = min(scale, VISION_SHORT_SIDE / min(width * scale, height * scale) * scale)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def tile_geometry(width, height, max_tiles=VISION_MAX_TILES):
+    """
+    Largest size with the same aspect ratio (never upscaled) that the model bills as at
+    most max_tiles tiles, after its own fit into 2048x2048 and 768px short side.
+    """
+    width, height = vision_size(width, height)
+    best = 0.0
+    for cols in range(1, max_tiles + 1):
+        rows = max_tiles // cols
+        best = max(best, min(1.0, cols * TILE_SIZE / width, rows * TILE_SIZE / height))
+    return max(1, math.floor(width * best)), max(1, math.floor(height * best))
+
+
+def image_tokens(width, height, detail):
+    """Estimated prompt tokens of one image as the model bills it."""
+    if detail == "low":
+        return BASE_TOKENS
+    width, height = vision_size(width, height)
+    return BASE_TOKENS + TILE_TOKENS * math.ceil(width / TILE_SIZE) * math.ceil(height / TILE_SIZE)
+
+
+def choose_detail(kind=None):
+    """
+    Detail level for a slide of the given kind (see render.analyze_page). Title/outline
+    slides read fine at 512px; figures and text need the tiles to stay legible.
+    """
+    if VISION_DETAIL in ("high", "low"):
+        return VISION_DETAIL
+    return "low" if kind == "title" else "high"
+
+
+def image_size(width, height, detail="high"):
+    """Size a width x height image is sent at for the given detail level."""
+    if detail == "low":
+        scale = min(1.0, LOW_DETAIL_SIDE / max(width, height))
+        return max(1, round(width * scale)), max(1, round(height * scale))
+    return tile_geometry(width, height)
+
+
+def encode_image(image, detail="high"):
+    """
+    Resize a PIL image to image_size() and encode it in the payload format. render calls
+    this once per page, so the file it writes is exactly what the model is sent.
+    Returns (bytes, size).
+    """
+    image = image.convert("RGB")
+    size = image_size(*image.size, detail)
+    if size != image.size:
+        image = image.resize(size, Image.LANCZOS, reducing_gap=2.0)
+    buffer = io.BytesIO()
+    image.save(buffer, IMAGE_FORMAT.upper(), quality=VISION_QUALITY)
+    return buffer.getvalue(), size
+
+
+def prepare_image(image_path, detail="high"):
+    """
+    Payload for a slide image. Files render wrote for this detail level are sent as they
+    are; anything else (a full-size PNG, a page rendered for the other detail) is
+    encoded with encode_image first.
+    Returns {"url" (data URL), "detail", "width", "height", "bytes", "tokens"}.
+    """
+    with Image.open(image_path) as image:
+        size = image.size
+        # only the header has been read so far
+        if (image.format or "").lower() == IMAGE_FORMAT and size == image_size(*size, detail):
+            data = None
+        else:
+            data, size = encode_image(image, detail)
+    if data is None:
+        with open(image_path, "rb") as f:
+            data = f.read()
+
+    return {
+        "url": f"data:{MIME_TYPES[IMAGE_FORMAT]};base64,{base64.b64encode(data).decode('utf-8')}",
+        "detail": detail,
+        "width": size[0],
+        "height": size[1],
+        "bytes": len(data),
+        "tokens": image_tokens(size[0], size[1], detail),
+    }
+
+
+def payload_settings():
+    """Everything that changes the image the model sees, for script cache keys."""
+    return VISION_FORMAT, VISION_QUALITY, VISION_DETAIL, VISION_MAX_TILES
@@ -2,6 +2,7 @@ import os
 import re
 import base64
 import time
+import random
 import subprocess
 from tqdm import tqdm
 from PIL import Image
@@ -10,9 +11,17 @@ from openai import OpenAI
 import requests
 import json
 from pyht import Client, TTSOptions, Format
+import audio_probe
+from text_chunker import chunk_text
+from audio_join import write_joined_mp3
+import voice_registry
 from flask import Flask, render_template, request, redirect, url_for, send_from_directory, flash, session
 from werkzeug.utils import secure_filename
 import pymupdf  # Correct import for PyMuPDF
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -21,6 +30,23 @@ app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['OUTPUT_FOLDER'] = 'output'
 app.config['ALLOWED_EXTENSIONS'] = {'pdf', 'mp3'}
 
+# OpenAI clients are reused per API key so slides share keep-alive connections;
+# clients unused for this many seconds are closed
+OPENAI_CLIENT_IDLE_SECONDS = 300
+_openai_clients = {}  # api_key -> (client, last used)
+_openai_clients_lock = threading.Lock()
+
+def get_openai_client(api_key):
+    now = time.monotonic()
+    with _openai_clients_lock:
+        for key, (client, last_used) in list(_openai_clients.items()):
+            if key != api_key and now - last_used > OPENAI_CLIENT_IDLE_SECONDS:
+                del _openai_clients[key]
+                client.close()
+        client = _openai_clients[api_key][0] if api_key in _openai_clients else OpenAI(api_key=api_key)
+        _openai_clients[api_key] = (client, now)
+    return client
+
 # Helper function to check allowed file extensions
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
@@ -37,7 +63,7 @@ def generate_slide_script(image_path, slide_number, total_slides, previous_conte
     
     print(f"Using API Key: {api_key}")  # Debug print
 
-    client = OpenAI(api_key=api_key)
+    client = get_openai_client(api_key)
     base64_image = encode_image(image_path)
     
     system_message = {
@@ -115,6 +141,47 @@ def generate_slide_script(image_path, slide_number, total_slides, previous_conte
     except Exception as e:
         print(f"Error generating script for slide {slide_number}: {str(e)}")
         return "", messages
+# PlayHT requests in flight per account (match the plan's concurrency limit), slides
+# synthesized at once, and tries per TTS request (PlayHT chunk or OpenAI slide) before its
+# slide is given up; waits between tries start at TTS_BACKOFF_BASE seconds and double
+PLAYHT_CONCURRENCY = int(os.getenv("PLAYHT_CONCURRENCY", "3"))
+AUDIO_SLIDE_WORKERS = int(os.getenv("AUDIO_SLIDE_WORKERS", "4"))
+TTS_ATTEMPTS = 3
+TTS_BACKOFF_BASE = 1.0
+_playht_slots = {}  # user_id -> semaphore
+_playht_slots_lock = threading.Lock()
+# chunk requests run here, apart from the slide workers that wait on them
+_playht_executor = ThreadPoolExecutor(max_workers=4 * PLAYHT_CONCURRENCY, thread_name_prefix="playht-chunk")
+
+def playht_slot(user_id):
+    with _playht_slots_lock:
+        if user_id not in _playht_slots:
+            _playht_slots[user_id] = threading.BoundedSemaphore(max(1, PLAYHT_CONCURRENCY))
+        return _playht_slots[user_id]
+
+def with_retries(fn, description, attempts=TTS_ATTEMPTS):
+    """
+    fn() with up to `attempts` tries and jittered exponential backoff in between.
+    Client errors (bad key, rejected input) fail at once, except 429.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return fn()
+        except Exception as e:
+            status = getattr(e, "status_code", None)
+            if attempt >= attempts or (status and 400 <= status < 500 and status != 429):
+                raise
+            delay = TTS_BACKOFF_BASE * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+            print(f"Error processing {description}, retry {attempt} in {delay:.1f}s: {e}")
+            time.sleep(delay)
+
+def synthesize_playht_chunk(client, text, options, user_id):
+    """Complete MP3 for one chunk of text, retried (see with_retries)."""
+    def synthesize():
+        with playht_slot(user_id):
+            return b"".join(client.tts(text=text, voice_engine="Play3.0-mini", options=options))
+    return with_retries(synthesize, f"chunk {text[:30]!r}...")
+
 # Function to generate audio using OpenAI or Play.ht
 def generate_audio(script_text, slide_number, output_dir, api_key, user_id=None, custom_voice_id=None):
     audio_path = os.path.join(output_dir, f"slide_{slide_number}.mp3")
@@ -137,73 +204,112 @@ def generate_audio(script_text, slide_number, output_dir, api_key, user_id=None,
             sample_rate=24000
         )
 
-        # Split the script text into chunks for processing
-        text_chunks = split_text_into_chunks(script_text)
-
-        # Generate the audio for each chunk and save it to the file
-        with open(audio_path, "wb") as audio_file:
-            for chunk_text in text_chunks:
-                if chunk_text.strip():  # Ensure chunk is not empty
-                    try:
-                        # Send the chunk to Play.ht and write the audio stream to the file
-                        for chunk in client.tts(text=chunk_text, voice_engine="Play3.0-mini", options=options):
-                            audio_file.write(chunk)
-                    except Exception as e:
-                        print(f"Error processing chunk for slide {slide_number}: {repr(chunk_text)}")
-                        print(f"Exception: {e}")
+        # Synthesize the chunks concurrently (within the account's limit) and join them in order
+        parts = list(_playht_executor.map(
+            lambda text: synthesize_playht_chunk(client, text, options, user_id),
+            chunk_text(script_text)
+        ))
+        write_joined_mp3(parts, audio_path)
+        audio_probe.record_duration(audio_path, audio_probe.get_duration(audio_path))
 
         print(f"Audio for slide {slide_number} generated using Play.ht.")
     else:
         # Use OpenAI's default TTS
-        client = OpenAI(api_key=api_key)
-        response = client.audio.speech.create(
-            model="tts-1",
-            voice="alloy",
-            input=script_text
-        )
-        response.stream_to_file(audio_path)
+        client = get_openai_client(api_key)
+        tmp_path = f"{audio_path}.tmp"
+
+        def synthesize():
+            response = client.audio.speech.create(
+                model="tts-1",
+                voice="alloy",
+                input=script_text
+            )
+            response.write_to_file(tmp_path)
+            return response
+
+        try:
+            response = with_retries(synthesize, f"OpenAI TTS for slide {slide_number}")
+            os.replace(tmp_path, audio_path)
+        finally:
+            # a failed or interrupted download never leaves a partial file behind
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        duration = audio_probe.parse_duration(response.content)
+        if duration is not None:
+            audio_probe.record_duration(audio_path, duration)
     
-    time.sleep(1)  # Small delay to ensure file is written
     return audio_path
 
-def split_text_into_chunks(text, max_lines=6, max_chars=500):
-    lines = re.split(r'(?<=\]) ', text)  # Split while preserving section headers and timestamps
-    chunks = []
-    chunk = []
-    char_count = 0
 
-    for line in lines:
-        if char_count + len(line) <= max_chars and len(chunk) < max_lines:
-            chunk.append(line)
-            char_count += len(line)
-        else:
-            chunks.append(" ".join(chunk))
-            chunk = [line]
-            char_count = len(line)
 
-    if chunk:
-        chunks.append(" ".join(chunk))
+# Function to convert PDF to images
 
-    return chunks
+# rasterization processes shared by all uploads, and how many pages may be rendered ahead
+# of the one being saved
+RENDER_WORKERS = min(4, os.cpu_count() or 1)
+RENDER_INFLIGHT = 2 * RENDER_WORKERS
 
+# document the worker process has open, and its path
+_worker_document = None
+_worker_document_path = None
+_render_pool = None
+_render_pool_lock = threading.Lock()
 
-# Function to convert PDF to images
+def start_render_pool(workers=RENDER_WORKERS):
+    """
+    Create the render process pool once, at app start. Workers come from a fork server
+    rather than fork(), which could copy a lock held by another request thread.
+    """
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _render_pool = ProcessPoolExecutor(max_workers=workers,
+                                               mp_context=multiprocessing.get_context(start_method))
+        return _render_pool
+
+def _render_page(pdf_path, page_number, images_dir):
+    global _worker_document, _worker_document_path
+    if _worker_document_path != pdf_path:
+        if _worker_document is not None:
+            _worker_document.close()
+        _worker_document = pymupdf.open(pdf_path)
+        _worker_document_path = pdf_path
+    page = _worker_document[page_number]
+    zoom = 300 / 72  # Scale factor for high-resolution images
+    matrix = pymupdf.Matrix(zoom, zoom)  # Use pymupdf.Matrix
+    pixmap = page.get_pixmap(matrix=matrix)
+    img_data = Image.frombytes("RGB", [pixmap.width, pixmap.height], pixmap.samples)
+    output_path = os.path.join(images_dir, f'page_{page_number + 1}.png')
+    img_data.save(output_path, 'PNG')
+    return output_path
 
-def convert_pdf_to_images(pdf_path):
+def convert_pdf_to_images(pdf_path, inflight=RENDER_INFLIGHT):
     images_dir = os.path.join(app.config['OUTPUT_FOLDER'], 'images')
     os.makedirs(images_dir, exist_ok=True)
-    
-    pdf_document = pymupdf.open(pdf_path)  # Use pymupdf.open instead of fitz.open
-    for page_number in tqdm(range(pdf_document.page_count), desc="Converting PDF pages", unit="page"):
-        page = pdf_document[page_number]
-        zoom = 300 / 72  # Scale factor for high-resolution images
-        matrix = pymupdf.Matrix(zoom, zoom)  # Use pymupdf.Matrix
-        pixmap = page.get_pixmap(matrix=matrix)
-        img_data = Image.frombytes("RGB", [pixmap.width, pixmap.height], pixmap.samples)
-        output_path = os.path.join(images_dir, f'page_{page_number + 1}.png')
-        img_data.save(output_path, 'PNG')
-    
-    pdf_document.close()
+
+    with pymupdf.open(pdf_path) as pdf_document:  # Use pymupdf.open instead of fitz.open
+        page_count = pdf_document.page_count
+    if page_count == 0:
+        return images_dir
+
+    # each worker process opens the PDF itself; only `inflight` pages are queued at once,
+    # which caps the number of pixmaps in memory
+    executor = start_render_pool()
+    pages = iter(range(page_count))
+    pending = deque()
+    with tqdm(total=page_count, desc="Converting PDF pages", unit="page") as progress:
+        for page_number in pages:
+            pending.append(executor.submit(_render_page, pdf_path, page_number, images_dir))
+            if len(pending) >= max(1, inflight):
+                break
+        while pending:
+            pending.popleft().result()
+            progress.update(1)
+            page_number = next(pages, None)
+            if page_number is not None:
+                pending.append(executor.submit(_render_page, pdf_path, page_number, images_dir))
+
     return images_dir
 
 
@@ -249,31 +355,33 @@ def generate_audio_files(scripts_list, openai_api_key, playht_api_key=None, user
     """
     audio_dir = os.path.join(app.config['OUTPUT_FOLDER'], 'audio')
     os.makedirs(audio_dir, exist_ok=True)
-    
-    for i, script_text in enumerate(scripts_list, start=1):
-        if not script_text.strip():
-            print(f"Warning: Script for slide {i} is empty. Skipping audio generation.")
-            continue
-        
-        try:
-            if custom_voice_id:
-                # Use Play.ht for custom voice
-                if not playht_api_key or not user_id:
-                    raise ValueError("Play.ht API key and user ID are required for custom voice generation.")
-                audio_path = generate_audio(
-                    script_text, i, audio_dir, playht_api_key, user_id, custom_voice_id
-                )
-            else:
-                # Use OpenAI TTS for default voice
-                audio_path = generate_audio(
-                    script_text, i, audio_dir, openai_api_key
-                )
-            
-            # Verify the audio file was created
-            if not (os.path.exists(audio_path) and os.path.getsize(audio_path) > 0):
-                print(f"Warning: Audio file {audio_path} not created properly")
-        except Exception as e:
-            print(f"Error generating audio for slide {i}: {e}")
+
+    def generate(i, script_text):
+        if custom_voice_id:
+            # Use Play.ht for custom voice
+            if not playht_api_key or not user_id:
+                raise ValueError("Play.ht API key and user ID are required for custom voice generation.")
+            return generate_audio(script_text, i, audio_dir, playht_api_key, user_id, custom_voice_id)
+        # Use OpenAI TTS for default voice
+        return generate_audio(script_text, i, audio_dir, openai_api_key)
+
+    # slides run concurrently; Play.ht chunk requests share the account's limit (see playht_slot)
+    futures = {}
+    with ThreadPoolExecutor(max_workers=AUDIO_SLIDE_WORKERS) as executor:
+        for i, script_text in enumerate(scripts_list, start=1):
+            if not script_text.strip():
+                print(f"Warning: Script for slide {i} is empty. Skipping audio generation.")
+                continue
+            futures[i] = executor.submit(generate, i, script_text)
+
+        for i, future in futures.items():
+            try:
+                audio_path = future.result()
+                # Verify the audio file was created
+                if not (os.path.exists(audio_path) and os.path.getsize(audio_path) > 0):
+                    print(f"Warning: Audio file {audio_path} not created properly")
+            except Exception as e:
+                print(f"Error generating audio for slide {i}: {e}")
     
     return audio_dir
 
@@ -281,16 +389,9 @@ def generate_audio_files(scripts_list, openai_api_key, playht_api_key=None, user
 
 def get_audio_duration(audio_path):
     """
-    Get audio duration using ffprobe.
+    Get audio duration: recorded at TTS time or parsed from the file, ffprobe as a fallback.
     """
-    
-    result = subprocess.run(
-        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
-         '-of', 'default=noprint_wrappers=1:nokey=1', audio_path],
-        capture_output=True,
-        text=True
-    )
-    return float(result.stdout.strip()) if result.stdout.strip() else 0.0
+    return audio_probe.get_duration(audio_path)
 
 def get_sorted_pairs(images_dir, audio_dir):
     """
@@ -337,9 +438,10 @@ def create_video_ffmpeg(images_dir, audio_dir, output_path="output/slideshow.mp4
     inputs = []
     filter_complex = []
 
+    durations = audio_probe.probe_directory(audio_dir)
     for i, (img, aud) in enumerate(pairs):
         inputs.extend(['-loop', '1', '-i', img, '-i', aud])
-        duration = get_audio_duration(aud)
+        duration = durations[os.path.basename(aud)]
         filter_complex.extend([
             f'[{2*i}:v]trim=duration={duration},setpts=PTS-STARTPTS[v{i}];',
             f'[{2*i+1}:a]acopy[a{i}];'
@@ -382,10 +484,10 @@ def create_video_ffmpeg(images_dir, audio_dir, output_path="output/slideshow.mp4
     print(f"Video created successfully at: {output_path}")
     return output_path
 
-def get_voice_id(audio_path, api_key, user_id):
+def clone_voice(audio_path, api_key, user_id):
+    """Upload the sample and create a new Play.ht instant cloned voice; returns its ID."""
     url = "https://api.play.ht/api/v2/cloned-voices/instant"
 
-    files = {"sample_file": (os.path.basename(audio_path), open(audio_path, "rb"), "audio/mpeg")}
     payload = {"voice_name": "custom-voice"}
     headers = {
         "accept": "application/json",
@@ -393,11 +495,20 @@ def get_voice_id(audio_path, api_key, user_id):
         "X-USER-ID": user_id
     }
 
-    response = requests.post(url, data=payload, files=files, headers=headers)
+    with open(audio_path, "rb") as sample:
+        files = {"sample_file": (os.path.basename(audio_path), sample, "audio/mpeg")}
+        response = requests.post(url, data=payload, files=files, headers=headers)
     response_data = response.json()
     voice_id = response_data.get("id")
     return voice_id
 
+# voice clones started by /upload, running alongside rasterization and scripting
+_voice_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="voice-clone")
+
+def get_voice_id(audio_path, api_key, user_id):
+    """Cloned voice for this sample: reused from the voice registry, cloned only on a miss."""
+    return voice_registry.get_or_clone(audio_path, user_id, lambda: clone_voice(audio_path, api_key, user_id))
+
 
 # Flask routes
 @app.route('/')
@@ -438,15 +549,11 @@ def upload_file():
         pdf_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(pdf_file.filename))
         pdf_file.save(pdf_path)
 
-        # Convert PDF to images
-        images_dir = convert_pdf_to_images(pdf_path)
-        
-        # Generate scripts for images
-        scripts_list = generate_scripts_for_images(images_dir, openai_key)
-        
-        # Handle custom voice
-        custom_voice_id = None
+        # Save the custom voice sample and start cloning it right away: it does not depend
+        # on the slides, so it runs while the PDF is rasterized and scripted
+        voice_future = None
         if voice_type == 'custom':
+            custom_voice_path = None
             if voice_source == 'upload' and custom_voice_file and allowed_file(custom_voice_file.filename):
                 # Save the uploaded custom voice file
                 custom_voice_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(custom_voice_file.filename))
@@ -455,9 +562,22 @@ def upload_file():
                 # Save the recorded custom voice file
                 custom_voice_path = os.path.join(app.config['UPLOAD_FOLDER'], 'recorded_voice.mp3')
                 custom_voice_file.save(custom_voice_path)
-            
-            # Get the custom voice ID
-            custom_voice_id = get_voice_id(custom_voice_path, playht_api_key, playht_user_id)
+            if custom_voice_path:
+                voice_future = _voice_executor.submit(get_voice_id, custom_voice_path, playht_api_key, playht_user_id)
+
+        # Convert PDF to images
+        images_dir = convert_pdf_to_images(pdf_path)
+        
+        # Generate scripts for images
+        scripts_list = generate_scripts_for_images(images_dir, openai_key)
+        
+        # TTS needs both the scripts and the voice; wait for the clone if it is still running
+        custom_voice_id = None
+        if voice_type == 'custom':
+            try:
+                custom_voice_id = voice_future.result() if voice_future else None
+            except Exception as e:
+                print(f"Error creating custom voice: {e}")
             if not custom_voice_id:
                 flash("Failed to generate custom voice ID. Falling back to OpenAI TTS.", "warning")
         
@@ -506,4 +626,5 @@ def serve_video(filename):
 if __name__ == '__main__':
     os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
     os.makedirs(app.config['OUTPUT_FOLDER'], exist_ok=True)
+    start_render_pool()
     app.run(debug=True)
\ No newline at end of file
@@ -10,6 +10,8 @@ from openai import OpenAI
 import requests
 import json
 from pyht import Client, TTSOptions, Format
+import audio_probe
+from text_chunker import chunk_text
 from flask import Flask, render_template, request, redirect, url_for, send_from_directory, flash, session
 from werkzeug.utils import secure_filename
 import pymupdf  # Correct import for PyMuPDF
@@ -147,18 +149,18 @@ def generate_audio(script_text, slide_number, output_dir, api_key, user_id=None,
         )
 
         # Split the script text into chunks for processing
-        text_chunks = split_text_into_chunks(script_text)
+        text_chunks = chunk_text(script_text)
 
         # Generate the audio for each chunk and save it to the file
         with open(audio_path, "wb") as audio_file:
-            for chunk_text in text_chunks:
-                if chunk_text.strip():  # Ensure chunk is not empty
+            for text_chunk in text_chunks:
+                if text_chunk.strip():  # Ensure chunk is not empty
                     try:
                         # Send the chunk to Play.ht and write the audio stream to the file
-                        for chunk in client.tts(text=chunk_text, voice_engine="Play3.0-mini", options=options):
+                        for chunk in client.tts(text=text_chunk, voice_engine="Play3.0-mini", options=options):
                             audio_file.write(chunk)
                     except Exception as e:
-                        print(f"Error processing chunk for slide {slide_number}: {repr(chunk_text)}")
+                        print(f"Error processing chunk for slide {slide_number}: {repr(text_chunk)}")
                         print(f"Exception: {e}")
 
         print(f"Audio for slide {slide_number} generated using Play.ht.")
@@ -175,25 +177,6 @@ def generate_audio(script_text, slide_number, output_dir, api_key, user_id=None,
     time.sleep(1)  # Small delay to ensure file is written
     return audio_path
 
-def split_text_into_chunks(text, max_lines=6, max_chars=500):
-    lines = re.split(r'(?<=\]) ', text)  # Split while preserving section headers and timestamps
-    chunks = []
-    chunk = []
-    char_count = 0
-
-    for line in lines:
-        if char_count + len(line) <= max_chars and len(chunk) < max_lines:
-            chunk.append(line)
-            char_count += len(line)
-        else:
-            chunks.append(" ".join(chunk))
-            chunk = [line]
-            char_count = len(line)
-
-    if chunk:
-        chunks.append(" ".join(chunk))
-
-    return chunks
 
 
 # Function to convert PDF to images
@@ -292,16 +275,9 @@ def generate_audio_files(scripts_list, openai_api_key, playht_api_key=None, user
 
 def get_audio_duration(audio_path):
     """
-    Get audio duration using ffprobe.
+    Get audio duration: recorded at TTS time or parsed from the file, ffprobe as a fallback.
     """
-    
-    result = subprocess.run(
-        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
-         '-of', 'default=noprint_wrappers=1:nokey=1', audio_path],
-        capture_output=True,
-        text=True
-    )
-    return float(result.stdout.strip()) if result.stdout.strip() else 0.0
+    return audio_probe.get_duration(audio_path)
 
 def get_sorted_pairs(images_dir, audio_dir):
     """
@@ -0,0 +1,76 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+# cloned voice IDs by PlayHT account and voice sample content; delete an entry (or the
+# file) to clone that sample again, e.g. after removing the voice on PlayHT
+REGISTRY_PATH = os.getenv("VOICE_REGISTRY_PATH", "voice_registry.json")
+
+_lock = threading.Lock()
+_sample_locks = {}
+
+
+def sample_hash(sample_path):
+    """sha256 of the sample's bytes, so a renamed or re-uploaded recording still matches."""
+    digest = hashlib.sha256()
+    with open(sample_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _load():
+    try:
+        with open(REGISTRY_PATH) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError:
+        print(f"Voice registry {REGISTRY_PATH} is unreadable, starting a new one")
+        return {}
+
+
+def _save(entries):
+    directory = os.path.dirname(REGISTRY_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{REGISTRY_PATH}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(entries, f, indent=2)
+    os.replace(tmp_path, REGISTRY_PATH)
+
+
+def lookup(user_id, digest):
+    """The voice ID cloned from the sample with this hash on user_id's account, or None."""
+    with _lock:
+        entry = _load().get(f"{user_id}:{digest}")
+    return entry["voice_id"] if entry else None
+
+
+def register(user_id, digest, voice_id):
+    with _lock:
+        entries = _load()
+        entries[f"{user_id}:{digest}"] = {"voice_id": voice_id, "created": time.time()}
+        _save(entries)
+
+
+def get_or_clone(sample_path, user_id, clone):
+    """
+    Voice ID for the sample at sample_path on user_id's account. clone() uploads the
+    sample and returns the new voice ID; it is only called when the registry has no voice
+    for this sample yet, and at most once at a time per sample.
+    """
+    digest = sample_hash(sample_path)
+    with _lock:
+        sample_lock = _sample_locks.setdefault(f"{user_id}:{digest}", threading.Lock())
+    with sample_lock:
+        voice_id = lookup(user_id, digest)
+        if voice_id:
+            print(f"Reusing cloned voice {voice_id} for sample {digest[:12]}")
+            return voice_id
+        voice_id = clone()
+        if voice_id:
+            register(user_id, digest, voice_id)
+        return voice_id
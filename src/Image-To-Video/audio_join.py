@@ -0,0 +1,77 @@
+# shared module: edit src/Shared/audio_join.py and run src/Shared/sync.py to update the copies
+import os
+
+# MPEG audio layer III tables, indexed by the frame header fields
+_BITRATES = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 2.5: (11025, 12000, 8000)}
+_VERSIONS = {3: 1, 2: 2, 0: 2.5}
+
+
+def frame_header(data, offset=0):
+    """
+    (frame length, samples, sample rate, side info length) of the layer III frame starting
+    at offset, or None if there is no valid frame header there.
+    """
+    if offset + 4 > len(data) or data[offset] != 0xFF or data[offset + 1] & 0xE0 != 0xE0:
+        return None
+    b1, b2, b3 = data[offset + 1], data[offset + 2], data[offset + 3]
+    version = _VERSIONS.get((b1 >> 3) & 3)
+    bitrate_index, rate_index = b2 >> 4, (b2 >> 2) & 3
+    if version is None or (b1 >> 1) & 3 != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    bitrate = _BITRATES[1 if version == 1 else 2][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    padding = (b2 >> 1) & 1
+    mono = b3 >> 6 == 3
+    if version == 1:
+        return 144 * bitrate // sample_rate + padding, 1152, sample_rate, 17 if mono else 32
+    return 72 * bitrate // sample_rate + padding, 576, sample_rate, 9 if mono else 17
+
+
+def id3v2_size(data):
+    """Length of the ID3v2 tag at the start of data (0 if there is none)."""
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def audio_frames(data):
+    """
+    The MP3 frames of one file, without tags: leading ID3v2, trailing ID3v1, and the
+    Xing/Info/VBRI frame whose length and seek table would only describe this part once
+    several files are joined.
+    """
+    start = id3v2_size(data)
+    end = len(data)
+    if end - start >= 128 and data[end - 128:end - 125] == b"TAG":
+        end -= 128
+    header = frame_header(data, start)
+    if header:
+        length, _, _, side_info = header
+        first = data[start:start + length]
+        if first[4 + side_info:8 + side_info] in (b"Xing", b"Info") or first[36:40] == b"VBRI":
+            start += length
+    return data[start:end]
+
+
+def write_joined_mp3(parts, path):
+    """
+    Concatenate the MP3 responses in parts, in order, into one file at path. Tags and
+    per-part VBR headers are dropped so the result is a single continuous stream.
+    Written under a temporary name and renamed, so path never holds a partial file.
+    """
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            for part in parts:
+                f.write(audio_frames(part))
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
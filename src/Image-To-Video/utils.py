@@ -1,11 +1,30 @@
 import os
 import re
+import json
 import base64
+import hashlib
 import time
 from tqdm import tqdm
 import fitz
 from PIL import Image
-import subprocess
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import audio_probe
+
+# rasterization processes, and how many pages may be rendered ahead of the one being saved
+RENDER_WORKERS = min(4, os.cpu_count() or 1)
+RENDER_INFLIGHT = 2 * RENDER_WORKERS
+
+# document opened once per worker process
+_worker_document = None
+
+# chat responses are cached on disk, keyed by model, parameters and normalized messages
+LLM_CACHE_DIR = os.getenv("MAESTRO_LLM_CACHE_DIR", os.path.join("output", "llm_cache"))
+LLM_CACHE_TTL = int(os.getenv("MAESTRO_LLM_CACHE_TTL", str(30 * 24 * 3600)))
+LLM_CACHE_MAX_BYTES = int(os.getenv("MAESTRO_LLM_CACHE_MAX_MB", "256")) * 1024 * 1024
+llm_cache_stats = {"hits": 0, "misses": 0, "expired": 0, "bypassed": 0}
 
 def setup_directories():
     for d in ["uploads", "output/images", "output/scripts", "output/audio", "static"]:
@@ -41,32 +60,54 @@ def natural_sort_key(s):
     return [int(text) if text.isdigit() else text.lower()
             for text in re.split(r'(\d+)', s)]
 
-def convert_pdf_to_images(pdf_path):
+def _init_render_worker(pdf_path):
+    global _worker_document
+    _worker_document = fitz.open(pdf_path)
+
+def _render_page(page_number, images_dir):
+    """render one page inside a worker process."""
+    page = _worker_document[page_number]
+    zoom = 300 / 72
+    matrix = fitz.Matrix(zoom, zoom)
+    pixmap = page.get_pixmap(matrix=matrix)
+    img_data = Image.frombytes("RGB", [pixmap.width, pixmap.height], pixmap.samples)
+    output_path = os.path.join(images_dir, f'page_{page_number + 1}.png')
+    img_data.save(output_path, 'PNG')
+    return output_path
+
+def convert_pdf_to_images(pdf_path, workers=RENDER_WORKERS, inflight=RENDER_INFLIGHT):
+    """render pages on a process pool; each worker opens the PDF itself."""
     images_dir = "output/images"
     os.makedirs(images_dir, exist_ok=True)
 
-    pdf_document = fitz.open(pdf_path)
-    for page_number in tqdm(range(pdf_document.page_count), desc="Converting PDF pages"):
-        page = pdf_document[page_number]
-        zoom = 300 / 72
-        matrix = fitz.Matrix(zoom, zoom)
-        pixmap = page.get_pixmap(matrix=matrix)
-        img_data = Image.frombytes("RGB", [pixmap.width, pixmap.height], pixmap.samples)
-        output_path = os.path.join(images_dir, f'page_{page_number + 1}.png')
-        img_data.save(output_path, 'PNG')
-    
-    pdf_document.close()
+    with fitz.open(pdf_path) as pdf_document:
+        page_count = pdf_document.page_count
+    if page_count == 0:
+        return images_dir
+
+    workers = max(1, min(workers, page_count))
+    pages = iter(range(page_count))
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_render_worker,
+                             initargs=(pdf_path,)) as executor:
+        # only `inflight` pages are queued at once, which caps pixmap memory
+        with tqdm(total=page_count, desc="Converting PDF pages") as progress:
+            for page_number in pages:
+                pending.append(executor.submit(_render_page, page_number, images_dir))
+                if len(pending) >= max(workers, inflight):
+                    break
+            while pending:
+                pending.popleft().result()
+                progress.update(1)
+                page_number = next(pages, None)
+                if page_number is not None:
+                    pending.append(executor.submit(_render_page, page_number, images_dir))
+
     return images_dir
 
 def get_audio_duration(audio_path):
-    """get audio duration using ffprobe."""
-    result = subprocess.run(
-        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
-         '-of', 'default=noprint_wrappers=1:nokey=1', audio_path],
-        capture_output=True,
-        text=True
-    )
-    return float(result.stdout.strip()) if result.stdout.strip() else 0.0
+    """get audio duration: recorded at TTS time or parsed from the file, ffprobe as a fallback."""
+    return audio_probe.get_duration(audio_path)
 
 def get_sorted_pairs(images_dir, audio_dir):
     """match images with audio files."""
@@ -78,4 +119,70 @@ def get_sorted_pairs(images_dir, audio_dir):
     return [(os.path.join(images_dir, img), os.path.join(audio_dir, aud))
             for img, aud in zip(images, audio_files)
             if int(re.search(r'page_(\d+)', img).group(1)) == 
-               int(re.search(r'slide_(\d+)', aud).group(1))]
\ No newline at end of file
+               int(re.search(r'slide_(\d+)', aud).group(1))]
+
+def _normalize_content(content):
+    if isinstance(content, str):
+        return content.strip()
+    parts = []
+    for part in content or []:
+        if part.get("type") == "image_url":
+            url = part["image_url"]["url"]
+            if url.startswith("data:"):
+                url = "sha256:" + hashlib.sha256(url.encode("ascii")).hexdigest()
+            parts.append({"type": "image_url", "url": url})
+        else:
+            parts.append({k: v.strip() if isinstance(v, str) else v for k, v in part.items()})
+    return parts
+
+def _evict_llm_cache():
+    """drop least recently used responses until the cache fits LLM_CACHE_MAX_BYTES."""
+    entries = []
+    for name in os.listdir(LLM_CACHE_DIR):
+        path = os.path.join(LLM_CACHE_DIR, name)
+        stat = os.stat(path)
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= LLM_CACHE_MAX_BYTES:
+            break
+        os.remove(path)
+        total -= size
+
+def cached_chat_completion(client, use_cache=True, ttl=LLM_CACHE_TTL, **request):
+    """
+    client.chat.completions.create(**request) through the on-disk response cache.
+    Returns the response text. use_cache=False always calls the model.
+    """
+    if not use_cache:
+        llm_cache_stats["bypassed"] += 1
+        response = client.chat.completions.create(**request)
+        return response.choices[0].message.content or ""
+
+    params = {k: v for k, v in request.items() if k != "messages"}
+    messages = [{"role": m["role"], "content": _normalize_content(m.get("content"))}
+                for m in request["messages"]]
+    key = hashlib.sha256(json.dumps([params, messages], sort_keys=True).encode("utf-8")).hexdigest()
+    path = os.path.join(LLM_CACHE_DIR, f"{key}.json")
+
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        if time.time() - entry["created"] <= ttl:
+            llm_cache_stats["hits"] += 1
+            os.utime(path)
+            return entry["content"]
+        llm_cache_stats["expired"] += 1
+    else:
+        llm_cache_stats["misses"] += 1
+
+    response = client.chat.completions.create(**request)
+    content = response.choices[0].message.content or ""
+    if content.strip():
+        os.makedirs(LLM_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"created": time.time(), "content": content}, f)
+        os.replace(tmp_path, path)
+        _evict_llm_cache()
+    return content
@@ -2,12 +2,25 @@ import os
 import argparse
 from openai import OpenAI
 import subprocess
-import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from utils import *
+import audio_probe
 
-def generate_slide_script(image_path, slide_number, total_slides, previous_content, api_key):
-    """Generate script for a slide using LLM"""
-    client = OpenAI(api_key=api_key)
+# slides synthesized at once, and tries per slide before giving up on it
+TTS_WORKERS = int(os.getenv("MAESTRO_TTS_WORKERS", "4"))
+TTS_SLIDE_ATTEMPTS = int(os.getenv("MAESTRO_TTS_SLIDE_ATTEMPTS", "3"))
+
+# one client per API key for the whole run, so every slide reuses its keep-alive connections
+_openai_clients = {}
+
+def get_openai_client(api_key):
+    if api_key not in _openai_clients:
+        _openai_clients[api_key] = OpenAI(api_key=api_key)
+    return _openai_clients[api_key]
+
+def generate_slide_script(image_path, slide_number, total_slides, previous_content, api_key, use_cache=True):
+    """Generate script for a slide using LLM (answers are served from the response cache when possible)"""
+    client = get_openai_client(api_key)
     base64_image = encode_image(image_path)
     
     system_message = {
@@ -56,20 +69,22 @@ Speaking style:
     messages = [system_message] + (previous_content or []) + [user_message]
     
     try:
-        response = client.chat.completions.create(
+        script_text = cached_chat_completion(
+            client,
+            use_cache=use_cache,
             model="gpt-4o",
             messages=messages,
             max_tokens=350,
             temperature=0.7
         )
-        return response.choices[0].message.content, messages
+        return script_text, messages
     except Exception as e:
         print(f"Error generating script for slide {slide_number}: {str(e)}")
         return "", messages
 
 def generate_audio(script_text, slide_number, output_dir, api_key):
-    """Generate audio from script using OpenAI TTS."""
-    client = OpenAI(api_key=api_key)
+    """Generate audio from script using OpenAI TTS. Written to a temp file and renamed once complete."""
+    client = get_openai_client(api_key)
     response = client.audio.speech.create(
         model="tts-1",
         voice="alloy",
@@ -77,10 +92,49 @@ def generate_audio(script_text, slide_number, output_dir, api_key):
     )
     
     audio_path = os.path.join(output_dir, f"slide_{slide_number}.mp3")
-    response.stream_to_file(audio_path)
-    time.sleep(1)
+    tmp_path = f"{audio_path}.tmp"
+    try:
+        response.write_to_file(tmp_path)
+        size = os.path.getsize(tmp_path)
+        expected = response.response.headers.get("content-length")
+        if size == 0 or (expected and int(expected) != size):
+            raise IOError(f"audio for slide {slide_number} is incomplete ({size} of {expected or '?'} bytes)")
+        os.replace(tmp_path, audio_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    duration = audio_probe.parse_duration(response.content)
+    if duration is not None:
+        audio_probe.record_duration(audio_path, duration)
     return audio_path
 
+def generate_slide_audio(script_text, slide_number, output_dir, api_key):
+    """generate_audio with retries; client errors (bad key, rejected input) fail at once."""
+    for attempt in range(1, TTS_SLIDE_ATTEMPTS + 1):
+        try:
+            return generate_audio(script_text, slide_number, output_dir, api_key)
+        except Exception as e:
+            status = getattr(e, "status_code", None)
+            if attempt >= TTS_SLIDE_ATTEMPTS or (status and 400 <= status < 500):
+                raise
+            print(f"Slide {slide_number}: audio attempt {attempt} failed ({e}), retrying")
+
+def generate_audio_files(scripts_list, output_dir, api_key):
+    """Synthesize every non-empty script, TTS_WORKERS at a time. Returns audio paths in slide order."""
+    futures = {}
+    with ThreadPoolExecutor(max_workers=TTS_WORKERS) as executor:
+        for i, script_text in enumerate(scripts_list, 1):
+            if script_text.strip():
+                futures[i] = executor.submit(generate_slide_audio, script_text, i, output_dir, api_key)
+        try:
+            for future in tqdm(as_completed(futures.values()), total=len(futures), desc="Generating audio"):
+                future.result()
+        except Exception:
+            for future in futures.values():
+                future.cancel()
+            raise
+    return [futures[i].result() if i in futures else None for i in range(1, len(scripts_list) + 1)]
+
 def create_video_ffmpeg(images_dir, audio_dir, output_path):
     """Create final video with optimized FFmpeg settings."""
     pairs = get_sorted_pairs(images_dir, audio_dir)
@@ -89,12 +143,13 @@ def create_video_ffmpeg(images_dir, audio_dir, output_path):
 
     filter_complex = []
     inputs = []
+    durations = audio_probe.probe_directory(audio_dir)
     
     for i, (img, aud) in enumerate(pairs):
         inputs.extend(['-loop', '1', '-i', img, '-i', aud])
         filter_complex.append(
             f'[{2*i}:v][{2*i+1}:a]'
-            f'trim=duration={get_audio_duration(aud)}'
+            f'trim=duration={durations[os.path.basename(aud)]}'
             f'[v{i}][a{i}]'
         )
     
@@ -121,6 +176,7 @@ def main():
     parser.add_argument("pdf_path", help="Path to the PDF file")
     parser.add_argument("api_key", help="OpenAI API key")
     parser.add_argument("--output", default="output.mp4", help="Output video path")
+    parser.add_argument("--no-cache", action="store_true", help="Always call the model instead of reusing cached scripts")
     args = parser.parse_args()
 
     setup_directories()
@@ -142,7 +198,8 @@ def main():
         
         for i, image_file in enumerate(tqdm(image_files, desc="Generating scripts"), 1):
             script_text, updated_history = generate_slide_script(
-                image_file, i, len(image_files), conversation_history, args.api_key
+                image_file, i, len(image_files), conversation_history, args.api_key,
+                use_cache=not args.no_cache
             )
             conversation_history = updated_history
             scripts_list.append(script_text)
@@ -150,13 +207,13 @@ def main():
             with open(os.path.join(scripts_dir, f"slide_{i}_script.txt"), "w") as f:
                 f.write(script_text)
         
+        print(f"Script cache: {llm_cache_stats}")
+
         print("Generating audio...")
         audio_dir = "output/audio"
         os.makedirs(audio_dir, exist_ok=True)
         
-        for i, script_text in enumerate(tqdm(scripts_list, desc="Generating audio"), 1):
-            if script_text.strip():
-                generate_audio(script_text, i, audio_dir, args.api_key)
+        generate_audio_files(scripts_list, audio_dir, args.api_key)
         
         print("Creating final video...")
         create_video_ffmpeg(images_dir, audio_dir, args.output)
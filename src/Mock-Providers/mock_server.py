@@ -0,0 +1,404 @@
+"""
+Local stand-in for the OpenAI and PlayHT HTTP APIs, for offline and deterministic runs.
+
+Modes:
+  fake    answer every request locally: plausible scripts, silent or tone audio,
+          hashed embeddings, all after configurable latency
+  record  forward requests to the real APIs and save every response
+  replay  serve saved responses (with their original latency); unknown requests fall
+          back to fake unless --strict is given
+
+Point the pipelines at it with
+  OPENAI_BASE_URL=http://127.0.0.1:8089/v1   (read by the openai SDK and LangChain)
+  PLAYHT_API_URL=http://127.0.0.1:8089       (read by voice_cloning.py)
+"""
+import os
+import re
+import io
+import json
+import math
+import time
+import wave
+import random
+import struct
+import hashlib
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+OPENAI_UPSTREAM = "https://api.openai.com"
+PLAYHT_UPSTREAM = "https://api.play.ht"
+
+# latency model for fake mode, in milliseconds
+CHAT_FIRST_TOKEN_MS = 600
+CHAT_TOKEN_MS = 25
+TTS_BASE_MS = 300
+TTS_CHAR_MS = 0.5
+EMBEDDING_MS = 150
+# narration speed used to size fake audio
+WORDS_PER_SECOND = 2.5
+EMBEDDING_DIMENSIONS = 1536
+
+WORDS = ("the algorithm", "each step", "this structure", "the key idea", "our input", "the result",
+         "every element", "the next stage", "this property", "the complexity", "the data", "the model")
+VERBS = ("splits", "combines", "compares", "updates", "reduces", "maps", "selects", "explains",
+         "builds on", "depends on", "refines", "connects")
+
+# a silent MPEG-1 Layer III frame: 128 kbit/s, 44.1 kHz, mono, no CRC; zeroed side info
+# and main data decode to 1152 samples of silence
+MP3_FRAME = bytes([0xFF, 0xFB, 0x90, 0xC4]) + bytes(417 - 4)
+MP3_FRAME_SECONDS = 1152 / 44100
+# what encoders put in front of a stream, as PlayHT's responses carry: an ID3v2 tag (10
+# bytes of padding) and a LAME "Info" frame (after the 17 bytes of mono side info)
+MP3_PREAMBLE = b"ID3\x04\x00\x00\x00\x00\x00\x0a" + bytes(10) + MP3_FRAME[:21] + b"Info" + MP3_FRAME[25:]
+
+
+# --- fake responses -------------------------------------------------------------------------
+
+def _seed(*parts):
+    return int(hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()[:16], 16)
+
+
+def _message_text(messages):
+    texts = []
+    for message in messages or []:
+        content = message.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+        else:
+            texts.extend(part.get("text", "") for part in content or [] if part.get("type") == "text")
+    return "\n".join(texts)
+
+
+def fake_script(messages, max_tokens):
+    """A few deterministic sentences, seeded by the request, mentioning the slide's own text."""
+    rng = random.Random(_seed(messages))
+    prompt = _message_text(messages[-1:]) if messages else ""
+    visible = re.search(r"(?:visible content of the slide is|lines added):\s*\n(.+)", prompt, re.S)
+    topics = [line.strip() for line in (visible.group(1).splitlines() if visible else []) if line.strip()]
+    sentences = []
+    words = 0
+    while words < min(max_tokens or 350, 350) * 0.6:
+        if topics and rng.random() < 0.5:
+            sentence = f"Here we look at {rng.choice(topics).rstrip('.').lower()}."
+        else:
+            sentence = f"{rng.choice(WORDS).capitalize()} {rng.choice(VERBS)} {rng.choice(WORDS)}."
+        sentences.append(sentence)
+        words += len(sentence.split())
+        if len(sentences) >= 3 and rng.random() < 0.15:
+            break
+    return " ".join(sentences)
+
+
+def fake_outline(messages):
+    slides = re.findall(r"^Slide (\d+): (.*)$", _message_text(messages), re.M)
+    return "\n".join(f"{number}. {text[:80] or 'Figure'}" for number, text in slides)
+
+
+def audio_seconds(text):
+    return max(0.5, len(text.split()) / WORDS_PER_SECOND)
+
+
+def fake_pcm(seconds, tone_hz=0, rate=24000):
+    """16-bit mono PCM: silence, or a quiet sine tone so the audio is audibly there."""
+    frames = int(seconds * rate)
+    if not tone_hz:
+        return bytes(frames * 2)
+    return b"".join(struct.pack("<h", int(3000 * math.sin(2 * math.pi * tone_hz * n / rate)))
+                    for n in range(frames))
+
+
+def fake_audio(text, response_format, tone_hz=0):
+    """(content type, body) for text spoken at WORDS_PER_SECOND."""
+    seconds = audio_seconds(text)
+    if response_format == "pcm":
+        return "audio/pcm", fake_pcm(seconds, tone_hz)
+    if response_format == "wav":
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(24000)
+            wav.writeframes(fake_pcm(seconds, tone_hz))
+        return "audio/wav", buffer.getvalue()
+    # everything else gets silent MP3, which any decoder accepts
+    return "audio/mpeg", MP3_FRAME * math.ceil(seconds / MP3_FRAME_SECONDS)
+
+
+def fake_embedding(item):
+    rng = random.Random(_seed(item))
+    vector = [rng.gauss(0, 1) for _ in range(EMBEDDING_DIMENSIONS)]
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+# --- server ---------------------------------------------------------------------------------
+
+def request_key(method, path, body):
+    """Recording key: method, path and JSON body with inline images replaced by their hash."""
+    try:
+        payload = json.loads(body) if body else None
+        text = json.dumps(payload, sort_keys=True)
+    except ValueError:
+        text = hashlib.sha256(body).hexdigest()
+    text = re.sub(r"data:[^\"]+;base64,[A-Za-z0-9+/=]+",
+                  lambda match: "sha256:" + hashlib.sha256(match.group(0).encode()).hexdigest(), text)
+    return hashlib.sha256(f"{method} {path} {text}".encode()).hexdigest()
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "MaestroMock/1.0"
+
+    # --- plumbing
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status, content_type, body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, payload, status=200):
+        self._send(status, "application/json", json.dumps(payload).encode())
+
+    def _sleep(self, ms):
+        if ms > 0:
+            time.sleep(ms * self.server.latency_scale / 1000)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _dispatch(self, method):
+        body = self._body()
+        key = request_key(method, self.path, body)
+        self.server.count(self.server.mode)
+        if self.server.mode == "record":
+            return self._record(method, body, key)
+        if self.server.mode == "replay":
+            if self._replay(key):
+                return
+            if self.server.strict:
+                return self._json({"error": {"message": f"no recording for {method} {self.path}"}}, 404)
+            self.server.count("replay_misses")
+        self._fake(method, body)
+
+    # --- record / replay
+
+    def _recording_path(self, key):
+        return os.path.join(self.server.recordings, key[:2], f"{key}.json")
+
+    def _record(self, method, body, key):
+        upstream = PLAYHT_UPSTREAM if self.path.startswith("/api/") else OPENAI_UPSTREAM
+        headers = {name: value for name, value in self.headers.items()
+                   if name.lower() not in ("host", "content-length", "accept-encoding", "connection")}
+        started = time.time()
+        request = urllib.request.Request(upstream + self.path, data=body if method == "POST" else None,
+                                         headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(request, timeout=600) as response:
+                status, response_headers, content = response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            status, response_headers, content = e.code, e.headers, e.read()
+        elapsed = time.time() - started
+        content_type = response_headers.get("Content-Type", "application/octet-stream")
+        if status < 500:
+            path = self._recording_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # credentials are never written: only status, content type, latency and body
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"path": self.path, "status": status, "content_type": content_type,
+                           "elapsed": elapsed, "body": content.hex()}, f)
+        self._send(status, content_type, content)
+
+    def _replay(self, key):
+        try:
+            with open(self._recording_path(key), "r", encoding="utf-8") as f:
+                recording = json.load(f)
+        except FileNotFoundError:
+            return False
+        self._sleep(recording["elapsed"] * 1000)
+        self._send(recording["status"], recording["content_type"], bytes.fromhex(recording["body"]))
+        return True
+
+    # --- fake providers
+
+    def _fake(self, method, body):
+        try:
+            payload = json.loads(body) if body else {}
+        except ValueError:
+            payload = {}
+        path = self.path.split("?", 1)[0]
+        routes = {
+            "/v1/chat/completions": self._chat,
+            "/v1/completions": self._completion,
+            "/v1/audio/speech": self._speech,
+            "/v1/embeddings": self._embeddings,
+            "/api/v2/cloned-voices/instant": self._clone_voice,
+            "/api/v2/cloned-voices": self._list_voices,
+            "/api/v2/tts/stream": self._playht_tts,
+        }
+        handler = routes.get(path)
+        if handler is None:
+            return self._json({"error": {"message": f"mock server does not implement {method} {path}"}}, 404)
+        handler(payload, body)
+
+    def _chat(self, payload, _):
+        messages = payload.get("messages", [])
+        system = _message_text(messages[:1])
+        content = fake_outline(messages) if "one line per slide" in system else fake_script(
+            messages, payload.get("max_tokens"))
+        prompt_tokens = len(_message_text(messages)) // 4
+        completion_tokens = len(content) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        model = payload.get("model", "gpt-4o")
+        created = int(time.time())
+        self._sleep(CHAT_FIRST_TOKEN_MS)
+
+        if not payload.get("stream"):
+            self._sleep(CHAT_TOKEN_MS * completion_tokens)
+            return self._json({
+                "id": "chatcmpl-mock", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": usage,
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(data):
+            chunk = f"data: {data}\n\n".encode()
+            self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+            self.wfile.flush()
+
+        for word in re.findall(r"\S+\s*", content):
+            self._sleep(CHAT_TOKEN_MS * max(1, len(word) // 4))
+            event(json.dumps({"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": created,
+                              "model": model, "choices": [{"index": 0, "delta": {"content": word},
+                                                           "finish_reason": None}]}))
+        event(json.dumps({"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": created,
+                          "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}))
+        if (payload.get("stream_options") or {}).get("include_usage"):
+            event(json.dumps({"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": created,
+                              "model": model, "choices": [], "usage": usage}))
+        event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _completion(self, payload, _):
+        prompt = payload.get("prompt")
+        prompt = prompt[0] if isinstance(prompt, list) else prompt or ""
+        text = fake_script([{"role": "user", "content": str(prompt)}], payload.get("max_tokens") or 256)
+        self._sleep(CHAT_FIRST_TOKEN_MS + CHAT_TOKEN_MS * len(text) // 4)
+        self._json({
+            "id": "cmpl-mock", "object": "text_completion", "created": int(time.time()),
+            "model": payload.get("model", "gpt-3.5-turbo-instruct"),
+            "choices": [{"index": 0, "text": text, "finish_reason": "stop", "logprobs": None}],
+            "usage": {"prompt_tokens": len(str(prompt)) // 4, "completion_tokens": len(text) // 4,
+                      "total_tokens": (len(str(prompt)) + len(text)) // 4},
+        })
+
+    def _speech(self, payload, _):
+        text = payload.get("input", "")
+        self._sleep(TTS_BASE_MS + TTS_CHAR_MS * len(text))
+        content_type, audio = fake_audio(text, payload.get("response_format", "mp3"), self.server.tone_hz)
+        self._send(200, content_type, audio)
+
+    def _embeddings(self, payload, _):
+        items = payload.get("input", [])
+        if isinstance(items, str) or (items and isinstance(items[0], int)):
+            items = [items]
+        self._sleep(EMBEDDING_MS)
+        self._json({
+            "object": "list", "model": payload.get("model", "text-embedding-ada-002"),
+            "data": [{"object": "embedding", "index": i, "embedding": fake_embedding(item)}
+                     for i, item in enumerate(items)],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        })
+
+    def _clone_voice(self, _, body):
+        voice_id = hashlib.sha256(body).hexdigest()[:12]
+        self._sleep(TTS_BASE_MS * 5)
+        self._json({"id": f"s3://mock-voices/{voice_id}/manifest.json", "name": "mock-voice",
+                    "type": "instant"}, 201)
+
+    def _list_voices(self, *_):
+        self._json([])
+
+    def _playht_tts(self, payload, _):
+        text = payload.get("text", "")
+        self._sleep(TTS_BASE_MS + TTS_CHAR_MS * len(text))
+        content_type, audio = fake_audio(text, payload.get("output_format", "mp3"), self.server.tone_hz)
+        if content_type == "audio/mpeg":
+            audio = MP3_PREAMBLE + audio
+        self._send(200, content_type, audio)
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, mode="fake", recordings="recordings", latency_scale=1.0,
+                 tone_hz=0, strict=False, verbose=False):
+        super().__init__(address, MockHandler)
+        self.mode = mode
+        self.recordings = recordings
+        self.latency_scale = latency_scale
+        self.tone_hz = tone_hz
+        self.strict = strict
+        self.verbose = verbose
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake / record / replay server for the OpenAI and PlayHT APIs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--mode", choices=("fake", "record", "replay"), default="fake")
+    parser.add_argument("--recordings", default="recordings", help="Directory for recorded responses")
+    parser.add_argument("--latency-scale", type=float, default=1.0,
+                        help="Multiply every simulated or replayed delay (0 for no latency)")
+    parser.add_argument("--tone", type=float, default=0, help="Fake speech as a sine tone of this frequency (Hz) instead of silence")
+    parser.add_argument("--strict", action="store_true", help="In replay mode, answer 404 for unrecorded requests")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server = MockServer((args.host, args.port), mode=args.mode, recordings=args.recordings,
+                        latency_scale=args.latency_scale, tone_hz=args.tone, strict=args.strict,
+                        verbose=args.verbose)
+    print(f"Mock providers ({args.mode}) listening on http://{args.host}:{args.port}")
+    print(f"  OPENAI_BASE_URL=http://{args.host}:{args.port}/v1")
+    print(f"  PLAYHT_API_URL=http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Requests served: {server.counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Copy the shared modules in this directory into every app that uses them. Each app is
+built and deployed from its own directory (app/ is COPY'd into its Docker image), so they
+keep byte-identical copies instead of importing across directories.
+
+    python src/Shared/sync.py           # update the copies
+    python src/Shared/sync.py --check   # exit 1 if a copy differs, e.g. in CI
+"""
+import os
+import sys
+import shutil
+import argparse
+import filecmp
+
+SHARED_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(os.path.dirname(SHARED_DIR))
+
+# shared module -> directories (relative to the repository root) that keep a copy
+TARGETS = {
+    "audio_join.py": ["app", "media/AudioCloning", "src/Image-To-Video", "src/Voice_Cloning"],
+    "audio_probe.py": ["app", "media/AudioCloning", "src/Image-To-Video"],
+    "text_chunker.py": ["media/AudioCloning", "src/Voice_Cloning"],
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync shared modules into the apps")
+    parser.add_argument("--check", action="store_true", help="Only report copies that differ")
+    args = parser.parse_args()
+
+    stale = []
+    for name, directories in TARGETS.items():
+        source = os.path.join(SHARED_DIR, name)
+        for directory in directories:
+            target = os.path.join(REPO_ROOT, directory, name)
+            if os.path.exists(target) and filecmp.cmp(source, target, shallow=False):
+                continue
+            stale.append(os.path.relpath(target, REPO_ROOT))
+            if not args.check:
+                shutil.copyfile(source, target)
+
+    for path in stale:
+        print(f"{'differs' if args.check else 'updated'}: {path}")
+    if args.check and stale:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Compare the old "]"-based splitter with text_chunker.chunk_text on a directory of
+slide_N_script.txt files: PlayHT requests per slide and, with --synthesize, total
+synthesis time (point PLAYHT_API_URL at src/Mock-Providers/mock_server.py to run it
+without an account).
+
+    python benchmark_chunker.py ../../media/AudioCloning/output/scripts --synthesize
+"""
+import os
+import re
+import time
+import argparse
+import statistics
+
+from text_chunker import MAX_CHARS, chunk_text
+
+
+def legacy_split_text_into_chunks(text, max_lines=6, max_chars=500):
+    """The splitter chunk_text replaced, kept here as the baseline."""
+    lines = re.split(r'(?<=\]) ', text)
+    chunks = []
+    chunk = []
+    char_count = 0
+
+    for line in lines:
+        if not line.strip():
+            continue
+
+        if char_count + len(line) <= max_chars and len(chunk) < max_lines:
+            chunk.append(line)
+            char_count += len(line)
+        else:
+            if chunk:
+                chunks.append(" ".join(chunk))
+            chunk = [line]
+            char_count = len(line)
+
+    if chunk:
+        chunks.append(" ".join(chunk))
+
+    return chunks
+
+
+def load_scripts(input_dir):
+    scripts = []
+    for filename in os.listdir(input_dir):
+        match = re.match(r"slide_(\d+)_script\.txt$", filename)
+        if match:
+            with open(os.path.join(input_dir, filename)) as f:
+                scripts.append((int(match.group(1)), f.read().strip()))
+    return [text for _, text in sorted(scripts) if text]
+
+
+def synthesize(chunks):
+    """Seconds to stream every chunk, one request after another as the pipelines do."""
+    from voice_cloning import tts_stream
+    started = time.perf_counter()
+    for chunk in chunks:
+        for _ in tts_stream(chunk):
+            pass
+    return time.perf_counter() - started
+
+
+def report(name, scripts, splitter, run_synthesis):
+    per_slide = [splitter(text) for text in scripts]
+    counts = [len(chunks) for chunks in per_slide]
+    sizes = [len(chunk) for chunks in per_slide for chunk in chunks]
+    line = (f"{name:>8}: {sum(counts)} requests, {statistics.mean(counts):.2f}/slide (max {max(counts)}), "
+            f"{statistics.mean(sizes):.0f} chars/request (max {max(sizes)})")
+    if run_synthesis:
+        line += f", synthesis {sum(synthesize(chunks) for chunks in per_slide):.1f}s"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PlayHT text chunking")
+    parser.add_argument("input_dir", help="Directory of slide_N_script.txt files")
+    parser.add_argument("--max-chars", type=int, default=MAX_CHARS, help="Per-request limit for chunk_text")
+    parser.add_argument("--synthesize", action="store_true", help="Also time the TTS requests")
+    args = parser.parse_args()
+
+    scripts = load_scripts(args.input_dir)
+    if not scripts:
+        raise SystemExit(f"No slide_N_script.txt files in {args.input_dir}")
+    print(f"{len(scripts)} slides, {sum(len(text) for text in scripts)} characters")
+    report("before", scripts, legacy_split_text_into_chunks, args.synthesize)
+    report("after", scripts, lambda text: chunk_text(text, args.max_chars), args.synthesize)
+
+
+if __name__ == "__main__":
+    main()
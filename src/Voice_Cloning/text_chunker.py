@@ -0,0 +1,107 @@
+# shared module: edit src/Shared/text_chunker.py and run src/Shared/sync.py to update the copies
+import os
+import re
+
+# longest text sent to PlayHT in one request; set it to your voice engine's per-request limit.
+# every request costs a round-trip and a fresh prosody start, so chunks are packed up to it
+MAX_CHARS = int(os.getenv("PLAYHT_MAX_CHARS", "2000"))
+
+# a sentence ends at . ! ? (plus closing quotes/brackets) followed by whitespace, so
+# "3.14" and "e.g.x" stay whole. Blank lines split too, and so does a "]" followed by
+# whitespace, as in the old splitter: "[s2] Next" yields "[s2]" as its own piece (packed
+# with its neighbors into one request again). "[slide2](intro)" has no space after the
+# "]" and stays part of its sentence
+_SENTENCE_END = re.compile(r"[.!?…]+[\"'”’)\]]*\s+|\]\s+|\n\s*\n")
+_CLAUSE_END = re.compile(r"[,;:—–]\s+")
+# a period after one of these words, a single capital ("J. Smith") or a dotted acronym
+# ("U.S. economy") does not end the sentence; compared against the whole last word, so
+# "piano." still does
+_ABBREVIATIONS = {"e.g.", "i.e.", "etc.", "vs.", "cf.", "al.", "fig.", "figs.", "eq.", "eqs.", "no.", "nos.",
+                  "approx.", "ca.", "dr.", "mr.", "mrs.", "ms.", "prof.", "st.", "jr.", "sr.", "inc.",
+                  "ltd.", "co.", "corp.", "dept.", "univ.", "vol.", "ch.", "sec.", "p.", "pp.", "jan.", "feb.",
+                  "mar.", "apr.", "jun.", "jul.", "aug.", "sep.", "sept.", "oct.", "nov.", "dec."}
+_INITIALS = re.compile(r"[A-Z]\.|(?:[A-Za-z]\.){2,}")
+
+
+def _ends_with_abbreviation(sentence):
+    words = sentence.split()
+    if not words:
+        return False
+    word = words[-1].lstrip("\"'“‘([")
+    return word.lower() in _ABBREVIATIONS or bool(_INITIALS.fullmatch(word))
+
+
+def split_sentences(text):
+    """Sentences of text, each with its trailing punctuation, whitespace normalized."""
+    sentences = []
+    start = 0
+    pending = ""
+    for match in _SENTENCE_END.finditer(text):
+        sentence = text[start:match.end()]
+        start = match.end()
+        if _ends_with_abbreviation(sentence):
+            pending += sentence
+            continue
+        sentences.append(pending + sentence)
+        pending = ""
+    sentences.append(pending + text[start:])
+    return [" ".join(sentence.split()) for sentence in sentences if sentence.strip()]
+
+
+def _split_long(sentence, max_chars):
+    """
+    A sentence over max_chars, cut at clause boundaries, then between words; a single word
+    over max_chars (a URL, a long formula) is cut outright so no request exceeds the limit.
+    """
+    parts = []
+    for clause in _pack(_split_at(sentence, _CLAUSE_END), max_chars):
+        if len(clause) <= max_chars:
+            parts.append(clause)
+            continue
+        words = []
+        for word in clause.split(" "):
+            words.extend(word[i:i + max_chars] for i in range(0, len(word), max_chars))
+        parts.extend(_pack(words, max_chars))
+    return parts
+
+
+def _split_at(text, pattern):
+    pieces = []
+    start = 0
+    for match in pattern.finditer(text):
+        pieces.append(text[start:match.end()].strip())
+        start = match.end()
+    pieces.append(text[start:].strip())
+    return [piece for piece in pieces if piece]
+
+
+def _pack(pieces, max_chars):
+    """Greedily join consecutive pieces with spaces while they fit in max_chars."""
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + 1 + len(piece) <= max_chars:
+            current += " " + piece
+        else:
+            if current:
+                chunks.append(current)
+            current = piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def chunk_text(text, max_chars=MAX_CHARS):
+    """
+    Split text into as few requests as possible: whole sentences are packed greedily up to
+    max_chars (for an ordered split this gives the minimum count). Only a single sentence
+    longer than max_chars is cut, at a clause boundary if it has one, otherwise between words
+    (or, for a single overlong word, anywhere).
+    """
+    pieces = []
+    for sentence in split_sentences(text):
+        if len(sentence) <= max_chars:
+            pieces.append(sentence)
+        else:
+            pieces.extend(_split_long(sentence, max_chars))
+    return _pack(pieces, max_chars)
@@ -2,14 +2,50 @@ import requests
 from pyht import Client, TTSOptions, Format
 import re
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from audio_join import write_joined_mp3
+from text_chunker import chunk_text
+import voice_registry
 
 API_KEY = "play_ht_api_key"
 USER_ID = "play_ht_user_id"
 AUDIO_URL = "url_to_voice_sample"
+# PlayHT REST API root. Setting PLAYHT_API_URL (e.g. to src/Mock-Providers/mock_server.py)
+# also switches TTS from the pyht client to the HTTP streaming endpoint
+PLAYHT_API_URL = os.getenv("PLAYHT_API_URL", "https://api.play.ht")
+USE_HTTP_TTS = "PLAYHT_API_URL" in os.environ
+# PlayHT requests in flight per account (match your plan's concurrency limit), slides
+# synthesized at once, and tries per chunk before its slide is given up
+PLAYHT_CONCURRENCY = int(os.getenv("PLAYHT_CONCURRENCY", "3"))
+PLAYHT_SLIDE_WORKERS = int(os.getenv("PLAYHT_SLIDE_WORKERS", "4"))
+PLAYHT_CHUNK_ATTEMPTS = int(os.getenv("PLAYHT_CHUNK_ATTEMPTS", "3"))
+
+_account_slots = {}
+_account_slots_lock = threading.Lock()
+# chunk requests run here, apart from the slide workers that wait on them
+_chunk_executor = ThreadPoolExecutor(max_workers=max(1, PLAYHT_CONCURRENCY), thread_name_prefix="playht-chunk")
 
 
 #Generate the voice clone voice id
 def create_instant_voice(api_key, user_id, audio_url):
+    """
+    Returns the voice_id of the PlayHT cloned voice for this sample. A sample that was
+    cloned before (same content, same account) is looked up in the voice registry;
+    anything else is uploaded and cloned.
+
+    Parameters:
+        api_key (str): The API key for authentication.
+        user_id (str): The user ID for authentication.
+        audio_url (str): The path to the audio file to be used for cloning.
+
+    Returns:
+        str: The voice_id of the cloned voice.
+    """
+    return voice_registry.get_or_clone(audio_url, user_id, lambda: clone_instant_voice(api_key, user_id, audio_url))
+
+def clone_instant_voice(api_key, user_id, audio_url):
     """
     Creates an instant cloned voice using the PlayHT API and returns the voice_id.
 
@@ -22,7 +58,7 @@ def create_instant_voice(api_key, user_id, audio_url):
         str: The voice_id of the created cloned voice.
     """
     # API endpoint
-    url = "https://api.play.ht/api/v2/cloned-voices/instant"
+    url = f"{PLAYHT_API_URL}/api/v2/cloned-voices/instant"
 
     # Prepare the payload and files
     payload = {"voice_name": "sales-voice"}
@@ -64,8 +100,8 @@ def create_instant_voice(api_key, user_id, audio_url):
             files["sample_file"][1].close()
 
 #Generate the Voice Clone
-# Initialize PlayHT API with your credentials
-client = Client(USER_ID, API_KEY)
+# Initialize PlayHT API with your credentials (not needed, nor reachable, when going over HTTP)
+client = None if USE_HTTP_TTS else Client(USER_ID, API_KEY)
 
 # Configure your stream
 options = TTSOptions(
@@ -79,32 +115,63 @@ options = TTSOptions(
     sample_rate=24000
 )
 
-# Function to split text into chunks based on max lines and max characters
-def split_text_into_chunks(text, max_lines=6, max_chars=500):
-    # Split text into lines while preserving section headers and timestamps
-    lines = re.split(r'(?<=\]) ', text)
-    chunks = []
-    chunk = []
-    char_count = 0
-
-    for line in lines:
-        # Skip empty lines
-        if not line.strip():
-            continue
-
-        if char_count + len(line) <= max_chars and len(chunk) < max_lines:
-            chunk.append(line)
-            char_count += len(line)
-        else:
-            if chunk:  # Only add non-empty chunks
-                chunks.append(" ".join(chunk))
-            chunk = [line]
-            char_count = len(line)
+def tts_stream(text, voice_engine="Play3.0-mini"):
+    """Yield audio chunks for text, from the pyht client or PlayHT's HTTP streaming endpoint."""
+    if not USE_HTTP_TTS:
+        yield from client.tts(text=text, voice_engine=voice_engine, options=options)
+        return
+    response = requests.post(
+        f"{PLAYHT_API_URL}/api/v2/tts/stream",
+        json={
+            "text": text,
+            "voice": options.voice,
+            "voice_engine": voice_engine,
+            "output_format": "mp3",
+            "speed": options.speed,
+            "temperature": options.temperature,
+            "quality": options.quality,
+            "voice_guidance": options.voice_guidance,
+            "style_guidance": options.style_guidance,
+            "sample_rate": options.sample_rate,
+        },
+        headers={"accept": "audio/mpeg", "AUTHORIZATION": API_KEY, "X-USER-ID": USER_ID},
+        stream=True,
+    )
+    response.raise_for_status()
+    yield from response.iter_content(chunk_size=16384)
+
+def account_slot(user_id):
+    """Semaphore bounding the PlayHT requests in flight for one account."""
+    with _account_slots_lock:
+        if user_id not in _account_slots:
+            _account_slots[user_id] = threading.BoundedSemaphore(max(1, PLAYHT_CONCURRENCY))
+        return _account_slots[user_id]
+
+def synthesize_chunk(text, voice_engine="Play3.0-mini"):
+    """Complete audio for one chunk of text, retried up to PLAYHT_CHUNK_ATTEMPTS times."""
+    for attempt in range(1, PLAYHT_CHUNK_ATTEMPTS + 1):
+        try:
+            with account_slot(USER_ID):
+                return b"".join(tts_stream(text, voice_engine))
+        except Exception as e:
+            if attempt >= PLAYHT_CHUNK_ATTEMPTS:
+                raise
+            print(f"Chunk {text[:30]!r}... failed ({e}), retry {attempt}/{PLAYHT_CHUNK_ATTEMPTS - 1}")
 
-    if chunk:  # Add the last chunk if it's not empty
-        chunks.append(" ".join(chunk))
+def synthesize_slide(slide, input_dir):
+    """
+    Synthesize a slide's chunks concurrently and join them, in order, into its MP3.
+    Returns the output path, or None when there is nothing to say.
+    """
+    slide_number = slide["slide_number"]
+    text_chunks = chunk_text(slide["slide_text"])
+    if not text_chunks:
+        print(f"Skipping slide {slide_number} because no valid chunks were generated.")
+        return None
 
-    return chunks
+    print(f"Processing {len(text_chunks)} chunk(s) for slide {slide_number}: {text_chunks[0][:50]}...")
+    parts = list(_chunk_executor.map(synthesize_chunk, text_chunks))
+    return write_joined_mp3(parts, os.path.join(input_dir, slide["output_filename"]))
 
 # Function to load and process a single script file
 def process_script_file(filepath):
@@ -172,48 +239,25 @@ def generate_audio_from_scripts(input_dir, script_format="multiple_files"):
     else:
         raise ValueError("Invalid script format specified.")
 
-    # Generate audio for each slide
     for slide in slides:
-        slide_number = slide["slide_number"]
-        slide_text = slide["slide_text"]
-        output_filename = slide["output_filename"]
-        output_filepath = os.path.join(input_dir, output_filename)
-
-        # Skip if the slide content is empty
-        if not slide_text:
-            print(f"Skipping slide {slide_number} because the script is empty.")
-            continue
-
-        # Split the slide content into chunks
-        text_chunks = split_text_into_chunks(slide_text)
-
-        # Skip if no valid chunks are found
-        if not text_chunks:
-            print(f"Skipping slide {slide_number} because no valid chunks were generated.")
-            continue
-
-        # Generate audio for the slide
-        try:
-            with open(output_filepath, "wb") as audio_file:
-                for chunk_text in text_chunks:
-                    # Validate the chunk before sending it to the API
-                    if not chunk_text.strip():  # Skip empty chunks
-                        print(f"Skipping empty chunk for slide {slide_number}.")
-                        continue
-
-                    # Log the chunk being sent to the API
-                    print(f"Processing chunk for slide {slide_number}: {chunk_text[:50]}...")  # Log first 50 chars
-
-                    # Send the chunk to the API
-                    for chunk in client.tts(text=chunk_text, voice_engine="Play3.0-mini", options=options):
-                        audio_file.write(chunk)
-
-            print(f"Audio for slide {slide_number} generated and saved as {output_filename}.")
-        except Exception as e:
-            print(f"Error generating audio for slide {slide_number}: {e}")
+        if not slide["slide_text"]:
+            print(f"Skipping slide {slide['slide_number']} because the script is empty.")
+
+    # Generate audio for the slides concurrently; chunk requests share the account's limit
+    slides = sorted((slide for slide in slides if slide["slide_text"]), key=lambda slide: int(slide["slide_number"]))
+    with ThreadPoolExecutor(max_workers=max(1, PLAYHT_SLIDE_WORKERS)) as executor:
+        futures = [executor.submit(synthesize_slide, slide, input_dir) for slide in slides]
+        for slide, future in zip(slides, futures):
+            try:
+                if future.result():
+                    print(f"Audio for slide {slide['slide_number']} generated and saved as {slide['output_filename']}.")
+            except Exception as e:
+                print(f"Error generating audio for slide {slide['slide_number']}: {e}")
 
 # Example usage
-input_dir = "/content/output/scripts"  # Directory containing script files
-script_format = "multiple_files"  # Options: "format_1", "format_2", "multiple_files"
+if __name__ == "__main__":
+    import sys
+    input_dir = sys.argv[1] if len(sys.argv) > 1 else "/content/output/scripts"  # Directory containing script files
+    script_format = "multiple_files"  # Options: "format_1", "format_2", "multiple_files"
 
-generate_audio_from_scripts(input_dir, script_format)
\ No newline at end of file
+    generate_audio_from_scripts(input_dir, script_format)
\ No newline at end of file